@@ -1,92 +1,541 @@
+import contextvars
+import json
 import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
-from datetime import datetime
+from urllib3.util.retry import Retry
+from datetime import datetime, timedelta, timezone
+from typing import Iterable
+from zoneinfo import ZoneInfo
+from consumption_index import ConsumptionIndex, IntervalBuffer
+from consumption_store import ConsumptionStore, from_epoch, to_epoch
+from metrics_functions import RUN_METRICS
+from rate_limiter import RateLimitedSession
+
+
+# Can be pointed at a local stand-in server, see benchmarks/bench_sync.py
+OCTOPUS_API_URL = "https://api.octopus.energy/v1"
+REQUEST_TIMEOUT = 30
+# The largest page the consumption endpoint returns, so a year of half-hourly data is a single page
+MAX_PAGE_SIZE = 25000
+STREAM_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_WORKERS = 4
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_sessions: dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_octopus_session(api_key: str, retries: int = 5, backoff_factor: float = 1.0, pool_maxsize: int = 10) -> requests.Session:
+    """
+    Returns the shared keep-alive session for the given API key, creating it on first use.
+    Requests failing with 429 or 5xx are retried with exponential backoff, honouring any Retry-After header, and every
+    request is paced by the shared rate limiter.
+    """
+    with _sessions_lock:
+        session = _sessions.get(api_key)
+        if session is None:
+            retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUS_CODES,
+                          allowed_methods=frozenset({"GET"}), respect_retry_after_header=True, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+            session = RateLimitedSession()
+            session.auth = HTTPBasicAuth(api_key, "")
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[api_key] = session
+        return session
+
+
+def format_period(value: datetime) -> str:
+    """
+    Formats a datetime the way the Octopus API expects it in period_from and period_to, in UTC
+    """
+    return from_epoch(to_epoch(value)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+AGGREGATION_LEVELS = ("quarter", "month", "day", "hour", None)
+# Octopus groups the consumption by the Europe/London calendar, so in British Summer Time the day, month and quarter
+# buckets start at 23:00 UTC
+OCTOPUS_TIMEZONE = ZoneInfo("Europe/London")
+
+
+def _floor_to_boundary(value: datetime, group_by: str) -> datetime:
+    """
+    Returns the largest group_by boundary which is not after value, in UTC. Naive values are treated as UTC.
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    local = value.astimezone(OCTOPUS_TIMEZONE)
+    if group_by == "quarter":
+        floor = local.replace(month=local.month - (local.month - 1) % 3, day=1, hour=0, minute=0, second=0,
+                              microsecond=0)
+    elif group_by == "month":
+        floor = local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    elif group_by == "day":
+        floor = local.replace(hour=0, minute=0, second=0, microsecond=0)
+    elif group_by == "hour":
+        floor = local.replace(minute=0, second=0, microsecond=0)
+    else:
+        raise ValueError(f"Unsupported group_by {group_by}")
+    return floor.astimezone(timezone.utc)
+
+
+def _ceil_to_boundary(value: datetime, group_by: str) -> datetime:
+    """
+    Returns the smallest group_by boundary which is not before value, in UTC
+    """
+    floor = _floor_to_boundary(value, group_by)
+    if floor == value:
+        return floor
+    if group_by == "hour":
+        return floor + timedelta(hours=1)
+    # Days and months are counted on the local calendar, so a day is 23 or 25 hours long when the clocks change
+    local = floor.astimezone(OCTOPUS_TIMEZONE)
+    if group_by in ("quarter", "month"):
+        months = 3 if group_by == "quarter" else 1
+        month_index = local.year * 12 + local.month - 1 + months
+        local = local.replace(year=month_index // 12, month=month_index % 12 + 1)
+    else:
+        local = local + timedelta(days=1)
+    return local.astimezone(timezone.utc)
+
+
+def plan_aggregated_windows(period_from: datetime, period_to: datetime,
+                            levels: tuple = AGGREGATION_LEVELS) -> list[tuple[datetime, datetime, str | None]]:
+    """
+    Splits [period_from, period_to) into consecutive windows, each with the coarsest group_by whose buckets fit into it
+    exactly, so only the ragged edges are fetched at a finer resolution. A group_by of None means raw intervals.
+    :return: A list of (window_from, window_to, group_by) tuples in chronological order
+    """
+    period_from = from_epoch(to_epoch(period_from))
+    period_to = from_epoch(to_epoch(period_to))
+
+    def plan(window_from: datetime, window_to: datetime, level: int) -> list:
+        if window_from >= window_to:
+            return []
+        group_by = levels[level]
+        if group_by is None:
+            return [(window_from, window_to, None)]
+        first = _ceil_to_boundary(window_from, group_by)
+        last = _floor_to_boundary(window_to, group_by)
+        if first >= last:
+            return plan(window_from, window_to, level + 1)
+        return plan(window_from, first, level + 1) + [(first, last, group_by)] + plan(last, window_to, level + 1)
+
+    return plan(period_from, period_to, 0)
+
+
+# The consumption endpoint of each fuel, export meters are electricity meter points with an export MPAN
+METER_POINT_PATHS = {
+    "gas": "gas-meter-points",
+    "electricity": "electricity-meter-points",
+    "export": "electricity-meter-points",
+}
+
+
+def consumption_url(meter_point: str, serial_number: str, fuel: str = "gas", **query) -> str:
+    """
+    Builds the URL of the consumption endpoint of a meter, ordered by period, with the query parameters which aren't None.
+    Datetime parameters are formatted the way the API expects them.
+    """
+    if fuel not in METER_POINT_PATHS:
+        raise ValueError(f"Unsupported fuel {fuel}, expected one of {', '.join(METER_POINT_PATHS)}")
+    url = f"{OCTOPUS_API_URL}/{METER_POINT_PATHS[fuel]}/{meter_point}/meters/{serial_number}/consumption/?order_by=period"
+    for name, value in query.items():
+        if value is not None:
+            url += f"&{name}={format_period(value) if isinstance(value, datetime) else value}"
+    return url
+
+
+def fetch_pages(url: str, api_key: str, read_page, logger_: logging.Logger = logging.getLogger()):
+    """
+    Follows the pages of a paginated Octopus endpoint starting at url, with the shared session of the API key.
+    :param read_page: Called with the streamed response of every page, returns the URL of the next page (or None),
+        the number of intervals and the number of bytes it read
+    """
+    session = get_octopus_session(api_key)
+    logger_.debug(f"URL: {url}")
+    while url:
+        started = time.perf_counter()
+        with session.get(url, timeout=REQUEST_TIMEOUT, stream=True) as response:
+            if response.status_code != 200:
+                logger_.error(f"Failed to retrieve data. Status code: {response.status_code}, Message: {response.text}")
+                raise requests.HTTPError(f"Failed to retrieve data. Status code: {response.status_code}", response=response)
+            url, intervals, bytes_ = read_page(response)
+        RUN_METRICS.record_page(time.perf_counter() - started, bytes_, intervals)
+
+
+def get_consumption_intervals(period_from: datetime | None, period_to: datetime | None,
+                              api_key: str, meter_point: str, serial_number: str, logger_: logging.Logger = logging.getLogger(),
+                              group_by: str | None = None, fuel: str = "gas") -> list:
+    """
+    Retrieves the consumption intervals from the Octopus Energy API for the given meter point and serial number,
+    starting at period_from (or the oldest available data if None) and ending at period_to (or the newest available
+    data if None). The intervals are the raw half-hourly ones unless group_by is given.
+    """
+    url = consumption_url(meter_point, serial_number, fuel, group_by=group_by, period_from=period_from,
+                          period_to=period_to)
+    intervals = []
+
+    def read_page(response) -> tuple[str | None, int, int]:
+        meter_readings = response.json()
+        intervals.extend(meter_readings["results"])
+        return meter_readings.get("next"), len(meter_readings["results"]), len(response.content)
+
+    logger_.info(f"Retrieving {fuel} consumption intervals from {period_from} to {period_to} for meter point: {meter_point}, Serial Number: {serial_number}")
+    fetch_pages(url, api_key, read_page, logger_)
+    logger_.info(f"Retrieved {len(intervals)} intervals")
+    return intervals
+
+
+_NEXT_URL = re.compile(rb'"next"\s*:\s*(null|"(?:[^"\\]|\\.)*")')
+_CONSUMPTION_FIELD = re.compile(rb'"consumption"\s*:\s*(-?[0-9.eE+-]+)')
+_INTERVAL_START_FIELD = re.compile(rb'"interval_start"\s*:\s*"([^"]+)"')
+_INTERVAL_END_FIELD = re.compile(rb'"interval_end"\s*:\s*"([^"]+)"')
+_SEPARATORS = b" \t\r\n,"
+
+
+def parse_consumption_stream(chunks: Iterable[bytes], buffer: IntervalBuffer) -> str | None:
+    """
+    Parses a consumption page as it arrives, appending the consumption and times of every interval to the buffer
+    without building the whole JSON document or a dict per interval. The results of the consumption endpoint are flat
+    objects, so each one ends at the first closing brace.
+    :return: The URL of the next page, or None if this is the last page
+    """
+    pending = bytearray()
+    outside_results = bytearray()
+    in_results = False
+    results_done = False
+    for chunk in chunks:
+        if results_done:
+            outside_results += chunk
+            continue
+        pending += chunk
+        if not in_results:
+            marker = pending.find(b'"results"')
+            if marker < 0:
+                continue
+            opening = pending.find(b"[", marker)
+            if opening < 0:
+                continue
+            outside_results += pending[:opening]
+            del pending[:opening + 1]
+            in_results = True
+
+        position = 0
+        while True:
+            while position < len(pending) and pending[position] in _SEPARATORS:
+                position += 1
+            if position >= len(pending):
+                break
+            if pending[position] == ord("]"):
+                results_done = True
+                break
+            closing = pending.find(b"}", position)
+            if closing < 0:
+                break
+            body = bytes(pending[position:closing])
+            buffer.append(to_epoch(_INTERVAL_START_FIELD.search(body).group(1).decode()),
+                          to_epoch(_INTERVAL_END_FIELD.search(body).group(1).decode()),
+                          float(_CONSUMPTION_FIELD.search(body).group(1)))
+            position = closing + 1
+        del pending[:position]
+        if results_done:
+            outside_results += pending
+            pending.clear()
+
+    outside_results += pending
+    match = _NEXT_URL.search(outside_results)
+    if match is None or match.group(1) == b"null":
+        return None
+    return json.loads(match.group(1))
+
+
+def stream_consumption_intervals(period_from: datetime, period_to: datetime,
+                                 api_key: str, meter_point: str, serial_number: str, logger_: logging.Logger = logging.getLogger(),
+                                 buffer: IntervalBuffer | None = None, fuel: str = "gas") -> IntervalBuffer:
+    """
+    Retrieves the raw half-hourly consumption intervals between two dates into a compact buffer, reading every page
+    as a stream with the largest page size the API allows.
+    """
+    url = consumption_url(meter_point, serial_number, fuel, page_size=MAX_PAGE_SIZE, period_from=period_from,
+                          period_to=period_to)
+    buffer = IntervalBuffer() if buffer is None else buffer
+
+    def read_page(response) -> tuple[str | None, int, int]:
+        intervals_before = len(buffer)
+        page_bytes = 0
+
+        def counted_chunks():
+            nonlocal page_bytes
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                page_bytes += len(chunk)
+                yield chunk
+
+        next_url = parse_consumption_stream(counted_chunks(), buffer)
+        return next_url, len(buffer) - intervals_before, page_bytes
+
+    logger_.info(f"Streaming {fuel} consumption intervals from {period_from} to {period_to} for meter point: {meter_point}, Serial Number: {serial_number}")
+    fetch_pages(url, api_key, read_page, logger_)
+    logger_.info(f"Retrieved {len(buffer)} intervals")
+    return buffer
+
+
+def _map_in_context(executor: ThreadPoolExecutor, function, items: Iterable) -> Iterable:
+    """
+    Maps function over the items in the executor, each call in a copy of the caller's context, so the metrics of the
+    download are kept for the meter which started it
+    """
+    items = list(items)
+    contexts = [contextvars.copy_context() for _ in items]
+    return executor.map(lambda context, item: context.run(function, item), contexts, items)
+
+
+def split_into_shards(period_from: datetime, period_to: datetime, shard_by: str = "month") -> list[tuple[datetime, datetime]]:
+    """
+    Splits [period_from, period_to) into consecutive independent sub-windows aligned to shard_by boundaries
+    """
+    period_from = from_epoch(to_epoch(period_from))
+    period_to = from_epoch(to_epoch(period_to))
+    shards = []
+    shard_from = period_from
+    while shard_from < period_to:
+        shard_to = min(_ceil_to_boundary(shard_from + timedelta(seconds=1), shard_by), period_to)
+        shards.append((shard_from, shard_to))
+        shard_from = shard_to
+    return shards
+
+
+def get_consumption_intervals_concurrently(period_from: datetime, period_to: datetime,
+                                           api_key: str, meter_point: str, serial_number: str, logger_: logging.Logger = logging.getLogger(),
+                                           max_workers: int = DEFAULT_MAX_WORKERS, shard_by: str = "month",
+                                           fuel: str = "gas") -> IntervalBuffer:
+    """
+    Retrieves the raw consumption intervals between two dates by streaming month sized shards in parallel, with at
+    most max_workers requests in flight. The shards are merged back in chronological order, so the result is the same
+    as a single sequential download.
+    """
+    shards = split_into_shards(period_from, period_to, shard_by)
+    logger_.debug(f"Fetching {len(shards)} shards with up to {max_workers} workers")
+    if len(shards) <= 1 or max_workers <= 1:
+        return stream_consumption_intervals(period_from, period_to, api_key, meter_point, serial_number, logger_,
+                                            fuel=fuel)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="octopus") as executor:
+        results = _map_in_context(
+            executor,
+            lambda shard: stream_consumption_intervals(shard[0], shard[1], api_key, meter_point, serial_number, logger_,
+                                                       fuel=fuel),
+            shards)
+        intervals = IntervalBuffer()
+        for shard_intervals in results:
+            intervals.extend(shard_intervals)
+    return intervals
+
+
+def get_aggregated_consumption(period_from: datetime, period_to: datetime,
+                               api_key: str, meter_point: str, serial_number: str, logger_: logging.Logger = logging.getLogger(),
+                               max_workers: int = DEFAULT_MAX_WORKERS, fuel: str = "gas") -> float:
+    """
+    Retrieves total consumption between two dates, letting the Octopus API aggregate whole quarters, months, days
+    and hours on the server, so only the ragged edges of the window are downloaded as raw intervals.
+    The windows are fetched in parallel.
+    """
+    windows = plan_aggregated_windows(period_from, period_to)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(windows))), thread_name_prefix="octopus") as executor:
+        results = _map_in_context(
+            executor,
+            lambda window: get_consumption_intervals(window[0], window[1], api_key, meter_point, serial_number, logger_,
+                                                     window[2], fuel),
+            windows)
+        return sum(interval["consumption"] for intervals in results for interval in intervals)
 
 
 def get_meter_reading_total_consumption(api_key: str, mprn: str, gas_serial_number: str, logger_: logging.Logger = logging.getLogger()) -> float:
     """
     Retrieves total gas consumption from the Octopus Energy API for the given gas meter point and serial number.
     """
-    url = f"https://api.octopus.energy/v1/gas-meter-points/{mprn}/meters/{gas_serial_number}/consumption/?group_by=quarter"
-    total_consumption = 0.0
     logger_.info(f"Retrieving total gas consumption for MPRN: {mprn}, Serial Number: {gas_serial_number}")
-    logger_.debug(f"URL: {url}")
-    while url:
-        response = requests.get(
-            url, auth=HTTPBasicAuth(api_key, "")
-        )
-
-        if response.status_code == 200:
-            meter_readings = response.json()
-            total_consumption += sum(
-                interval["consumption"] for interval in meter_readings["results"]
-            )
-            url = meter_readings.get("next", "")
-        else:
-            logger_.error(
-                f"Failed to retrieve data. Status code: {response.status_code}, Message: {response.text}"
-            )
-            break
+    intervals = get_consumption_intervals(None, None, api_key, mprn, gas_serial_number, logger_, "quarter")
+    total_consumption = sum(interval["consumption"] for interval in intervals)
 
     logger_.info(f"Total consumption is {total_consumption}")
     return total_consumption
 
 
+def update_consumption_store(store: ConsumptionStore, period_from: datetime,
+                             api_key: str, meter_point: str, serial_number: str, logger_: logging.Logger = logging.getLogger(),
+                             max_workers: int = DEFAULT_MAX_WORKERS, fuel: str = "gas") -> int:
+    """
+    Brings the local consumption store up to date for the given meter, only downloading the intervals that are
+    older than the store was filled from (if period_from is earlier) or newer than the newest stored interval.
+    :return: The number of intervals downloaded
+    """
+    # The store remembers how far back it was filled, so older history that Octopus doesn't have isn't asked for again
+    checked_from = store.checked_from(meter_point, serial_number) or store.earliest_interval_start(meter_point, serial_number)
+    latest = store.latest_interval_end(meter_point, serial_number)
+    now = datetime.now(timezone.utc)
+    downloaded = 0
+    if checked_from is None:
+        logger_.info(f"Consumption store is empty for meter point: {meter_point}, downloading from {period_from}")
+        intervals = get_consumption_intervals_concurrently(period_from, now, api_key, meter_point, serial_number, logger_,
+                                                           max_workers=max_workers, fuel=fuel)
+        store.set_checked_from(meter_point, serial_number, period_from)
+        return store.add_rows(meter_point, serial_number, intervals.rows())
+
+    if to_epoch(period_from) < to_epoch(checked_from):
+        intervals = get_consumption_intervals_concurrently(period_from, checked_from, api_key, meter_point, serial_number,
+                                                           logger_, max_workers=max_workers, fuel=fuel)
+        downloaded += store.add_rows(meter_point, serial_number, intervals.rows())
+        store.set_checked_from(meter_point, serial_number, period_from)
+
+    latest = latest or checked_from
+    logger_.info(f"Consumption store is up to date until {latest}, downloading newer intervals")
+    intervals = get_consumption_intervals_concurrently(latest, now, api_key, meter_point, serial_number, logger_,
+                                                       max_workers=max_workers, fuel=fuel)
+    downloaded += store.add_rows(meter_point, serial_number, intervals.rows())
+    return downloaded
+
+
 def get_consumption_between_dates(period_from: datetime, period_to: datetime,
-                                  api_key: str, mprn: str, gas_serial_number: str, logger_: logging.Logger = logging.getLogger()) -> float:
+                                  api_key: str, meter_point: str, serial_number: str, logger_: logging.Logger = logging.getLogger(),
+                                  store: ConsumptionStore | None = None, max_workers: int = DEFAULT_MAX_WORKERS,
+                                  fuel: str = "gas") -> float:
     """
-    Retrieves total gas consumption from the Octopus Energy API for the given gas meter point and serial number.
+    Retrieves total consumption from the Octopus Energy API for the given meter point and serial number.
+    If a consumption store is given, only the intervals missing from it are downloaded and the total is summed locally.
     """
-    url = (f"https://api.octopus.energy/v1/gas-meter-points/{mprn}/meters/{gas_serial_number}/consumption/?"
-           f"group_by=quarter&period_from={period_from}&period_to={period_to}")
-    total_consumption = 0.0
-    logger_.info(f"Retrieving gas consumption between {period_from} and {period_to} for MPRN: {mprn}, Serial Number: {gas_serial_number}")
-    logger_.debug(f"URL: {url}")
-    while url:
-        response = requests.get(
-            url, auth=HTTPBasicAuth(api_key, "")
-        )
-
-        if response.status_code == 200:
-            meter_readings = response.json()
-            for interval in meter_readings["results"]:
-                # this_consumption = interval["consumption"]
-                logger_.debug(f"Consumption between {interval['interval_start']} -> {interval['interval_end']}")
-                logger_.debug(f"Adding {total_consumption} + {interval['consumption']}")
-                total_consumption += interval["consumption"]
-
-            url = meter_readings.get("next", "")
-        else:
-            logger_.error(f"Failed to retrieve data. Status code: {response.status_code}, Message: {response.text}")
-            break
+    if store is not None:
+        update_consumption_store(store, period_from, api_key, meter_point, serial_number, logger_, max_workers, fuel)
+        total_consumption = store.consumption_between(meter_point, serial_number, period_from, period_to)
+        logger_.info(f"Consumption between {period_from} and {period_to} is {total_consumption}")
+        return total_consumption
+
+    logger_.info(f"Retrieving {fuel} consumption between {period_from} and {period_to} for meter point: {meter_point}, Serial Number: {serial_number}")
+    total_consumption = get_aggregated_consumption(period_from, period_to, api_key, meter_point, serial_number, logger_,
+                                                   max_workers, fuel)
 
     logger_.info(f"Consumption between {period_from} and {period_to} is {total_consumption}")
     return total_consumption
 
 
-def get_consumption_from_date(period_from: datetime, api_key: str, mprn: str, gas_serial_number: str, logger_: logging.Logger = logging.getLogger()) -> float:
+def get_consumption_from_date(period_from: datetime, api_key: str, meter_point: str, serial_number: str, logger_: logging.Logger = logging.getLogger(),
+                              store: ConsumptionStore | None = None, max_workers: int = DEFAULT_MAX_WORKERS,
+                              fuel: str = "gas") -> float:
     """
-    Retrieves total gas consumption from the Octopus Energy API for the given gas meter point and serial number.
+    Retrieves total consumption from the Octopus Energy API for the given meter point and serial number.
+    If a consumption store is given, only the intervals missing from it are downloaded and the total is summed locally.
     """
-    url = (f"https://api.octopus.energy/v1/gas-meter-points/{mprn}/meters/{gas_serial_number}/consumption/?"
-           f"group_by=quarter&period_from={period_from}")
-    total_consumption = 0.0
+    if store is not None:
+        update_consumption_store(store, period_from, api_key, meter_point, serial_number, logger_, max_workers, fuel)
+        total_consumption = store.consumption_between(meter_point, serial_number, period_from)
+        logger_.info(f"Consumption since {period_from} is {total_consumption}")
+        return total_consumption
 
-    while url:
-        response = requests.get(
-            url, auth=HTTPBasicAuth(api_key, "")
-        )
-
-        if response.status_code == 200:
-            meter_readings = response.json()
-            total_consumption += sum(
-                interval["consumption"] for interval in meter_readings["results"]
-            )
-            url = meter_readings.get("next", "")
-        else:
-            logger_.error(f"Failed to retrieve data. Status code: {response.status_code}, Message: {response.text}")
-            break
+    total_consumption = get_aggregated_consumption(period_from, datetime.now(timezone.utc), api_key, meter_point,
+                                                   serial_number, logger_, max_workers, fuel)
 
     logger_.info(f"Consumption since {period_from} is {total_consumption}")
-    return total_consumption
\ No newline at end of file
+    return total_consumption
+
+
+class OctopusMeter:
+    """
+    This class bundles the details of one Octopus meter, gas or electricity import or export, so the consumption can be
+    asked for by date only
+    """
+    def __init__(self, api_key: str, meter_point: str, serial_number: str, fuel: str = "gas",
+                 store: ConsumptionStore | None = None, logger_: logging.Logger = logging.getLogger(),
+                 max_workers: int = DEFAULT_MAX_WORKERS):
+        """
+        :param meter_point: The MPRN of a gas meter or the MPAN of an electricity meter
+        :param fuel: gas, electricity or export, see METER_POINT_PATHS
+        """
+        if fuel not in METER_POINT_PATHS:
+            raise ValueError(f"Unsupported fuel {fuel}, expected one of {', '.join(METER_POINT_PATHS)}")
+        self.api_key = api_key
+        self.meter_point = meter_point
+        self.serial_number = serial_number
+        self.fuel = fuel
+        self.store = store
+        self.logger_ = logger_
+        self.max_workers = max_workers
+        self._index = None
+
+    def update(self, period_from: datetime) -> int:
+        """
+        Brings the local store up to date from period_from, does nothing without a store.
+        :return: The number of intervals downloaded
+        """
+        if self.store is None:
+            return 0
+        with RUN_METRICS.phase("octopus_update"):
+            downloaded = update_consumption_store(self.store, period_from, self.api_key, self.meter_point,
+                                                  self.serial_number, self.logger_, self.max_workers, self.fuel)
+        # The index of the last run stays valid until new intervals arrive
+        if downloaded:
+            self._index = None
+        return downloaded
+
+    def consumption_between(self, period_from: datetime, period_to: datetime) -> float:
+        """
+        Returns the consumption between two dates, from the last index if it covers them, otherwise from the local store
+        if there is one, otherwise from the API
+        """
+        if self._index is not None and self._index.covers(period_from, period_to):
+            return self._index.consumption_between(period_from, period_to)
+        if self.store is not None:
+            return self.store.consumption_between(self.meter_point, self.serial_number, period_from, period_to)
+        return get_aggregated_consumption(period_from, period_to, self.api_key, self.meter_point, self.serial_number,
+                                          self.logger_, self.max_workers, self.fuel)
+
+    def intervals_between(self, period_from: datetime, period_to: datetime) -> Iterable[tuple[int, int, float]]:
+        """
+        Returns the (interval_start, interval_end, consumption) rows in [period_from, period_to), in epoch seconds.
+        The intervals are read from the local store, or downloaded if there is no store.
+        """
+        if self.store is not None:
+            return self.store.intervals_between(self.meter_point, self.serial_number, period_from, period_to)
+        return get_consumption_intervals_concurrently(period_from, period_to, self.api_key, self.meter_point,
+                                                      self.serial_number, self.logger_, max_workers=self.max_workers,
+                                                      fuel=self.fuel).rows()
+
+    def consumption_index(self, period_from: datetime, period_to: datetime) -> ConsumptionIndex:
+        """
+        Returns an index over the intervals in [period_from, period_to), reusing the last one if it covers the window.
+        The intervals are read from the local store, or downloaded once if there is no store.
+        """
+        if self._index is not None and self._index.covers(period_from, period_to):
+            return self._index
+        self._index = ConsumptionIndex(self.intervals_between(period_from, period_to), period_from, period_to)
+        self.logger_.debug(f"Indexed {len(self._index)} intervals between {period_from} and {period_to}")
+        return self._index
+
+    def cumulative_consumption(self, period_from: datetime, dates: list[datetime]) -> list[float]:
+        """
+        Returns the consumption from period_from until each of the dates, from a single index over the intervals
+        """
+        if not dates:
+            return []
+        return self.consumption_index(period_from, max(dates, key=to_epoch)).cumulative_consumption(period_from, dates)
+
+    def reconciled_consumption(self, period_from: datetime, dates: list[datetime]) -> list[tuple[float, float]]:
+        """
+        Returns the measured consumption and the estimated consumption of the gaps in the data from period_from until
+        each of the dates, see ConsumptionIndex.reconcile
+        """
+        if not dates:
+            return []
+        return self.consumption_index(period_from, max(dates, key=to_epoch)).reconcile(period_from, dates)
+
+
+class OctopusGasMeter(OctopusMeter):
+    """This class is an Octopus gas meter, identified by its MPRN"""
+    def __init__(self, api_key: str, mprn: str, gas_serial_number: str, store: ConsumptionStore | None = None,
+                 logger_: logging.Logger = logging.getLogger(), max_workers: int = DEFAULT_MAX_WORKERS):
+        super().__init__(api_key, mprn, gas_serial_number, "gas", store, logger_, max_workers)
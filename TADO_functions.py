@@ -1,9 +1,20 @@
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
+import json
 import logging
-from playwright.async_api import async_playwright
-from PyTado.interface import Tado
+import os
+import re
+import threading
+import weakref
+from typing import TYPE_CHECKING
 from logging_functions import create_debug_info_console_logger
+from metrics_functions import RUN_METRICS
+from rate_limiter import RateLimitedSession
+
+# PyTado and Playwright are only imported when Tado has to be logged in to, so runs served from the readings cache
+# don't pay for importing them
+if TYPE_CHECKING:
+    from PyTado.interface import Tado
 
 
 def send_reading_to_tado(username: str, password: str, reading: int = 0):
@@ -28,91 +39,525 @@ def send_reading_to_tado_with_date(username: str, password: str, reading: int =
     print(result)
 
 
-async def browser_login(url: str, username: str, password: str, logger_: logging.Logger = logging.getLogger()):
+DEFAULT_TOKEN_FILE_PATH = "tado_refresh_token"
+# Energy IQ meter readings are gas meter readings, so only gas meters can be synced to them
+EIQ_METER_FUELS = ("gas",)
+# Tado refresh tokens are rotated on every use and expire 30 days after they were issued, the lifetime Tado documents
+REFRESH_TOKEN_LIFETIME = timedelta(days=30)
+# The longest a step of the browser login may take, and how many accounts are logged in to at the same time
+DEFAULT_LOGIN_STEP_TIMEOUT_MS = 15000
+DEFAULT_LOGIN_CONCURRENCY = 4
+
+
+def default_readings_cache_path(username: str, home_id: int | None = None) -> str:
+    """
+    Returns the readings cache file of a home of a Tado account, so the readings of other accounts and homes are kept
+    apart
+    """
+    account = re.sub(r"[^A-Za-z0-9]", "_", username)
+    home = account if home_id is None else f"{account}_{home_id}"
+    return f"tado_meter_readings_{home}.json"
+
+
+async def _device_login(page, url: str, username: str, password: str, logger_: logging.Logger = logging.getLogger(),
+                        screenshot_path: str | None = None):
+    """
+    Fills in the Tado device verification page with the username and password, in an open page.
+    Every step waits for the default timeout of the page, see BrowserLoginPool.
+    """
+    logger_.debug(f"Opening browser to {url}")
+    await page.goto(url)
+
+    # Click the "Submit" button before login
+    await page.wait_for_selector('text="Submit"')
+    await page.click('text="Submit"')
+
+    # Wait for the login form to appear
+    await page.wait_for_selector('input[name="loginId"]')
+
+    # Replace with actual selectors for your site
+    logger_.debug(f"Filling in username and password...")
+    await page.fill('input[id="loginId"]', username)
+    await page.fill('input[name="password"]', password)
+
+    logger_.debug(f"Clicking \"Sign in\" button...")
+    await page.click('button.c-btn--primary:has-text("Sign in")')
+
+    await page.wait_for_selector(".text-center.message-screen.b-bubble-screen__spaced")
+
+    # Take a screenshot (optional)
+    if screenshot_path:
+        logger_.debug(f"Taking screenshot and saving to {screenshot_path}")
+        await page.screenshot(path=screenshot_path)
+
+
+class BrowserLoginPool:
+    """
+    This class starts Chromium once and runs the device verification of every account in its own isolated
+    BrowserContext, so the accounts don't share cookies and can be logged in to at the same time.
+    Use it as an async context manager.
+    """
+    def __init__(self, logger_: logging.Logger = logging.getLogger(),
+                 step_timeout_ms: int = DEFAULT_LOGIN_STEP_TIMEOUT_MS, concurrency: int = DEFAULT_LOGIN_CONCURRENCY):
+        """
+        :param step_timeout_ms: The longest any step of the login may take, e.g. waiting for the login form
+        :param concurrency: The largest number of logins in progress at the same time
+        """
+        self.logger_ = logger_
+        self.step_timeout_ms = step_timeout_ms
+        self.concurrency = concurrency
+        self._playwright = None
+        self._browser = None
+        self._semaphore = None
+
+    async def __aenter__(self) -> "BrowserLoginPool":
+        from playwright.async_api import async_playwright
+
+        self.logger_.info(f"Starting the browser for the Tado logins...")
+        self._playwright = await async_playwright().start()
+        try:
+            self._browser = await self._playwright.chromium.launch(headless=True)
+        except Exception:
+            await self._playwright.stop()
+            raise
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.logger_.debug(f"Closing browser...")
+        try:
+            await self._browser.close()
+        finally:
+            await self._playwright.stop()
+
+    async def login(self, url: str, username: str, password: str, screenshot_path: str | None = None):
+        """
+        Logs in to one device verification URL in a new BrowserContext, which is closed afterwards
+        """
+        async with self._semaphore:
+            context = await self._browser.new_context()
+            try:
+                context.set_default_timeout(self.step_timeout_ms)
+                page = await context.new_page()
+                await _device_login(page, url, username, password, self.logger_, screenshot_path)
+            finally:
+                await context.close()
+        self.logger_.debug(f"Login process completed for {username}.")
+
+    async def login_all(self, logins: list[tuple[str, str, str]]) -> list[Exception | None]:
+        """
+        Logs in to every (url, username, password) at the same time, up to the concurrency of the pool
+        :return: None for every successful login, or the exception it failed with, in the order of logins
+        """
+        return await asyncio.gather(*(self.login(url, username, password) for url, username, password in logins),
+                                    return_exceptions=True)
+
+
+async def browser_login(url: str, username: str, password: str, logger_: logging.Logger = logging.getLogger(),
+                        screenshot_path: str | None = None):
     """
     Perform the login process using Playwright.
     This function will open a browser, navigate to the login page,
     fill in the username and password, and click the login button.
-    It will also take a screenshot of the page after login.
     param url: The URL of the login page.
     param username: The username for login.
     param password: The password for login.
     param logger_: The logger object for logging messages.
+    param screenshot_path: If given, a screenshot of the page is saved here after login.
     return: None
     """
     logger_.info(f"Logging in to Tado using Playwright...")
-    
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(
-            headless=True
-        )  # Set to True if you don't want a browser window
-        context = await browser.new_context()
-        page = await context.new_page()
-
-        logger_.debug(f"Opening browser to {url}")
-        await page.goto(url)
-
-        # Click the "Submit" button before login
-        await page.wait_for_selector('text="Submit"', timeout=5000)
-        await page.click('text="Submit"')
-
-        # Wait for the login form to appear
-        await page.wait_for_selector('input[name="loginId"]')
-
-        # Replace with actual selectors for your site
-        logger_.debug(f"Filling in username and password...")
-        await page.fill('input[id="loginId"]', username)
-        await page.fill('input[name="password"]', password)
-
-        logger_.debug(f"Clicking \"Sign in\" button...")
-        await page.click('button.c-btn--primary:has-text("Sign in")')
-
-        # Optionally take a screenshot
-        await page.screenshot(path="screenshot.png")
-
-        await page.wait_for_selector(
-            ".text-center.message-screen.b-bubble-screen__spaced", timeout=10000
-        )
-
-        # Take a screenshot (optional)
-        screenshot_file = "screenshot.png"
-        logger_.debug(f"Taking screenshot and saving to {screenshot_file}")
-        await page.screenshot(path=screenshot_file)
-        logger_.debug(f"Closing browser...")
-        await browser.close()
-    
+    async with BrowserLoginPool(logger_, concurrency=1) as pool:
+        await pool.login(url, username, password, screenshot_path)
     logger_.debug(f"Login process completed.")
-    
 
 
-def tado_login(username: str, password: str, logger_: logging.Logger = logging.getLogger()) -> Tado:
+def _rate_limit_pytado_sessions():
+    """
+    Makes every session PyTado creates a RateLimitedSession. PyTado replaces the session it was given with a new one of
+    its own whenever it refreshes the token, so the session passed to Tado only paces the first requests.
+    """
+    from PyTado.http import Http
+
+    with _pytado_patch_lock:
+        if getattr(Http._create_session, "rate_limited", False):
+            return
+        create_session = Http._create_session
+
+        def create_rate_limited_session(http) -> RateLimitedSession:
+            # PyTado's session is only built for its hooks, adapters and headers
+            created = create_session(http)
+            session = RateLimitedSession()
+            session.hooks = created.hooks
+            session.adapters = created.adapters
+            session.headers = created.headers
+            return session
+
+        create_rate_limited_session.rate_limited = True
+        Http._create_session = create_rate_limited_session
+
+
+_pytado_patch_lock = threading.Lock()
+
+
+class TadoLoginManager:
+    """
+    This class keeps a logged in Tado object for one refresh token file.
+    The stored refresh token is tried first and the Playwright device login is only used when it can't be refreshed.
+    """
+    def __init__(self, token_file_path: str = DEFAULT_TOKEN_FILE_PATH, logger_: logging.Logger = logging.getLogger(),
+                 screenshot_path: str | None = None):
+        self.token_file_path = token_file_path
+        self.logger_ = logger_
+        self.screenshot_path = screenshot_path
+        self.tado = None
+        self._lock = threading.Lock()
+
+    @property
+    def expiry_file_path(self) -> str:
+        """The file next to the token file which older versions kept the token expiry in"""
+        return f"{self.token_file_path}.expires"
+
+    def has_stored_token(self) -> bool:
+        """
+        Checks that the token file exists and holds a refresh token, without contacting Tado
+        """
+        if not os.path.exists(self.token_file_path):
+            return False
+        try:
+            with open(self.token_file_path, encoding="utf-8") as token_file:
+                return bool(json.load(token_file).get("refresh_token"))
+        except (OSError, ValueError) as ex:
+            self.logger_.warning(f"Stored Tado token in {self.token_file_path} can't be read: {ex}")
+            return False
+
+    def has_valid_token(self) -> bool:
+        """
+        Checks that the token file holds a refresh token which hasn't expired yet, without contacting Tado
+        """
+        if not self.has_stored_token():
+            return False
+        expires_at = self.token_expires_at()
+        return expires_at is not None and datetime.now() < expires_at
+
+    def token_expires_at(self) -> datetime | None:
+        """
+        Returns when the stored refresh token expires: REFRESH_TOKEN_LIFETIME after the token file was written.
+        PyTado writes the file whenever it rotates the refresh token, so this follows every refresh of the session.
+        :return: None if there is no stored token
+        """
+        if not os.path.exists(self.token_file_path):
+            return None
+        return datetime.fromtimestamp(os.path.getmtime(self.token_file_path)) + REFRESH_TOKEN_LIFETIME
+
+    def is_logged_in(self) -> bool:
+        """
+        Checks whether the current session can still be used without logging in again
+        """
+        expires_at = self.token_expires_at()
+        return self.tado is not None and expires_at is not None and datetime.now() < expires_at
+
+    def login(self, username: str, password: str) -> "Tado":
+        """
+        Returns a logged in Tado object, reusing the current session if it is still valid
+        """
+        with self._lock:
+            if self.is_logged_in():
+                self.logger_.debug(f"Reusing Tado session, the token expires at {self.token_expires_at()}")
+                RUN_METRICS.set_label("tado_login_path", "session")
+                return self.tado
+
+            with RUN_METRICS.phase("tado_login"):
+                return self._login(username, password)
+
+    def _login(self, username: str, password: str) -> "Tado":
+        """
+        Logs in with the stored token, falling back to the browser login
+        """
+        tado = self.start_login()
+        status = tado.device_activation_status()
+
+        if status == "PENDING":
+            url = tado.device_verification_url()
+
+            RUN_METRICS.set_label("tado_login_path", "browser")
+            with RUN_METRICS.phase("tado_browser_login"):
+                asyncio.run(browser_login(url=str(url), username=username, password=password, logger_=self.logger_,
+                                          screenshot_path=self.screenshot_path))
+
+            tado.device_activation()
+        else:
+            RUN_METRICS.set_label("tado_login_path", "token")
+
+        return self.finish_login(tado)
+
+    def start_login(self) -> "Tado":
+        """
+        Creates the Tado object, which logs in with the stored token or starts the device login if that fails.
+        Its device_activation_status() is PENDING when the device verification URL has to be logged in to.
+        """
+        from PyTado.interface import Tado
+
+        if self.has_stored_token():
+            self.logger_.info(f"Logging in to Tado with the stored token in {self.token_file_path}...")
+        else:
+            self.logger_.info(f"No stored Tado token in {self.token_file_path}, the browser login is needed")
+        # The constructor refreshes the stored token, the device flow is only started if that fails.
+        # Its requests go through the shared rate limiter, like the Octopus ones.
+        _rate_limit_pytado_sessions()
+        return Tado(token_file_path=self.token_file_path, http_session=RateLimitedSession())
+
+    def finish_login(self, tado: "Tado") -> "Tado":
+        """
+        Keeps the Tado object as the current session if the login completed
+        """
+        status = tado.device_activation_status()
+        if status == "COMPLETED":
+            self.logger_.info(f"Login successful")
+            self.tado = tado
+            # The expiry is taken from the token file, an expiry file left by an older version would outlive it
+            try:
+                os.remove(self.expiry_file_path)
+            except FileNotFoundError:
+                pass
+            except OSError as ex:
+                self.logger_.warning(f"Old Tado token expiry file {self.expiry_file_path} can't be removed: {ex}")
+        else:
+            self.logger_.info(f"Login status is {status}")
+
+        return tado
+
+
+class TadoHome:
+    """
+    This class submits and reads the Energy IQ meter readings of one home of a logged in Tado account.
+    PyTado always uses the first home of the account, so the home is selected around each request. The homes of one
+    Tado object take turns at that, so every meter using the object should go through a TadoHome.
+    """
+    def __init__(self, tado: "Tado", home_id: int | None = None, logger_: logging.Logger = logging.getLogger()):
+        self.tado = tado
+        # Without a home id it is the home PyTado picked at login, which is kept here as other homes are selected
+        self.home_id = int(home_id if home_id is not None else tado._http._id)
+        self.logger_ = logger_
+        self._lock = _home_selection_lock(tado)
+
+    def _call(self, method: str, **kwargs):
+        # PyTado has no setter for the home, it keeps the id of the first home of /me in the http client
+        http = self.tado._http
+        with self._lock:
+            account_home_id = http._id
+            http._id = self.home_id
+            try:
+                return getattr(self.tado, method)(**kwargs)
+            finally:
+                http._id = account_home_id
+
+    def get_eiq_meter_readings(self) -> dict:
+        return self._call("get_eiq_meter_readings")
+
+    def set_eiq_meter_readings(self, date: str, reading: int) -> dict:
+        self.logger_.debug(f"Submitting the reading for {date} to Tado home {self.home_id}")
+        return self._call("set_eiq_meter_readings", date=date, reading=reading)
+
+
+def _home_selection_lock(tado: "Tado") -> threading.Lock:
+    """
+    Returns the lock of a Tado object, shared by every TadoHome of it, so homes of other accounts don't wait for it
+    """
+    with _home_selection_locks_lock:
+        return _home_selection_locks.setdefault(tado, threading.Lock())
+
+
+_home_selection_locks: "weakref.WeakKeyDictionary[Tado, threading.Lock]" = weakref.WeakKeyDictionary()
+_home_selection_locks_lock = threading.Lock()
+_cache_file_locks: dict[str, threading.Lock] = {}
+_cache_file_locks_lock = threading.Lock()
+
+
+def _cache_file_lock(path: str) -> threading.Lock:
+    """
+    Returns the lock of a reading cache file, shared by every TadoReadingCache of the process using that file
+    """
+    with _cache_file_locks_lock:
+        return _cache_file_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class TadoReadingCache:
+    """
+    This class keeps the Energy IQ meter readings of one Tado home in a local JSON file.
+    It can be used in place of the Tado object for reading and submitting meter readings: the readings are only
+    downloaded again when the file is older than max_age or refresh() is called, and submitted readings are added to
+    the file. Tado is only logged in to (with tado_factory) when it has to be contacted.
+    Several caches may share one file, e.g. meters of the same home in a batch: the file is only written under its
+    lock, and a submitted reading is added to what the file holds at that time instead of overwriting it.
+    """
+    def __init__(self, path: str, tado_factory, max_age: timedelta = timedelta(days=1),
+                 logger_: logging.Logger = logging.getLogger()):
+        self.path = path
+        self.tado_factory = tado_factory
+        self.max_age = max_age
+        self.logger_ = logger_
+        self.readings = None
+        self.fetched_at = None
+        self.refreshed = False
+        self._file_lock = _cache_file_lock(path)
+        with self._file_lock:
+            self.readings, self.fetched_at = self._read()
+
+    def _read(self) -> tuple[list | None, datetime | None]:
+        """
+        Reads the readings and download time from the cache file, (None, None) if there is no usable file
+        """
+        if not os.path.exists(self.path):
+            return None, None
+        try:
+            with open(self.path, encoding="utf-8") as cache_file:
+                data = json.load(cache_file)
+            return data["readings"], datetime.fromisoformat(data["fetched_at"])
+        except (OSError, ValueError, KeyError) as ex:
+            self.logger_.warning(f"Tado reading cache {self.path} can't be read, it will be downloaded again: {ex}")
+            return None, None
+
+    def _save(self):
+        with open(self.path, "w", encoding="utf-8") as cache_file:
+            json.dump({"fetched_at": self.fetched_at.isoformat(), "readings": self.readings}, cache_file)
+
+    def is_stale(self) -> bool:
+        return self.readings is None or datetime.now() - self.fetched_at > self.max_age
+
+    def refresh(self) -> dict:
+        """
+        Downloads the meter readings from Tado and stores them in the cache file
+        """
+        self.logger_.info(f"Downloading the Energy IQ meter readings from Tado")
+        tado = self.tado_factory()
+        with RUN_METRICS.phase("tado_eiq_fetch"):
+            result = tado.get_eiq_meter_readings()
+        self.readings = sorted(result["readings"], key=lambda reading: reading["date"])
+        self.fetched_at = datetime.now()
+        self.refreshed = True
+        with self._file_lock:
+            self._save()
+        return {**result, "readings": self.readings}
+
+    def get_eiq_meter_readings(self) -> dict:
+        """
+        Returns the meter readings the same way Tado does, from the cache file unless it is stale
+        """
+        if self.is_stale():
+            return self.refresh()
+        self.logger_.info(f"Using the Energy IQ meter readings cached at {self.fetched_at}")
+        RUN_METRICS.increment("tado_reading_cache_hits")
+        return {"readings": self.readings}
+
+    def set_eiq_meter_readings(self, date: str, reading: int) -> dict:
+        """
+        Submits a meter reading to Tado and adds it to the cache file
+        """
+        result = self.tado_factory().set_eiq_meter_readings(date=date, reading=reading)
+        with self._file_lock:
+            # Every change is saved to the file, which may also hold the readings of other caches of the same file
+            readings, fetched_at = self._read()
+            if readings is not None:
+                self.readings, self.fetched_at = readings, fetched_at
+            if self.readings is not None:
+                self.readings = sorted([existing for existing in self.readings if existing["date"] != date]
+                                       + [{"date": date, "reading": reading}], key=lambda existing: existing["date"])
+                self._save()
+        return result
+
+
+_login_managers: dict[str, TadoLoginManager] = {}
+_login_managers_lock = threading.Lock()
+
+
+def get_login_manager(token_file_path: str = DEFAULT_TOKEN_FILE_PATH, logger_: logging.Logger = logging.getLogger(),
+                      screenshot_path: str | None = None) -> TadoLoginManager:
+    """
+    Returns the shared login manager for the given token file, creating it on first use.
+    Tado rotates the refresh token on every use, so there can only be one manager per token file. Asking for it with
+    another logger or screenshot path than it was created with is an error rather than silently using the first ones.
+    """
+    with _login_managers_lock:
+        manager = _login_managers.get(token_file_path)
+        if manager is None:
+            manager = TadoLoginManager(token_file_path, logger_, screenshot_path)
+            _login_managers[token_file_path] = manager
+        elif manager.logger_ is not logger_ or manager.screenshot_path != screenshot_path:
+            raise ValueError(f"The Tado login for {token_file_path} is already used with the logger "
+                             f"{manager.logger_.name} and screenshot path {manager.screenshot_path}, not "
+                             f"{logger_.name} and {screenshot_path}")
+        return manager
+
+
+def tado_login(username: str, password: str, logger_: logging.Logger = logging.getLogger(),
+               token_file_path: str = DEFAULT_TOKEN_FILE_PATH, screenshot_path: str | None = None) -> "Tado":
     """
     Login to Tado using the provided username and password.
     If the login is successful, it returns a Tado object.
-    If the login is pending, it will prompt the user to complete the login process.
+    The stored refresh token is used when possible, the browser login is only started if the login is pending.
     """
     logger_.info(f"Logging in to Tado...")
-    url = "https://my.tado.com/en-GB/login"
-
-    tado = Tado(token_file_path="tado_refresh_token")
+    return get_login_manager(token_file_path, logger_, screenshot_path).login(username, password)
 
-    status = tado.device_activation_status()
 
-    if status == "PENDING":
-        url = tado.device_verification_url()
+async def tado_login_accounts(accounts: list[tuple[str, str, str]], logger_: logging.Logger = logging.getLogger(),
+                              step_timeout_ms: int = DEFAULT_LOGIN_STEP_TIMEOUT_MS,
+                              concurrency: int = DEFAULT_LOGIN_CONCURRENCY) -> dict[str, "Tado | Exception"]:
+    """
+    Logs in to many Tado accounts at once. The accounts whose stored token works are logged in to straight away, and
+    the device verification of all the others runs in one shared browser, each account in its own BrowserContext.
+    :param accounts: (username, password, token_file_path) of every account
+    :return: The logged in Tado object of every token file, or the exception its login failed with
+    """
+    accounts = list({token_file_path: (username, password, token_file_path)
+                     for username, password, token_file_path in accounts}.values())
+    managers = [get_login_manager(token_file_path, logger_) for _, _, token_file_path in accounts]
+    results = {}
 
-        asyncio.run(browser_login(url=str(url), username=username, password=password))
+    async def start(manager: TadoLoginManager):
+        if manager.is_logged_in():
+            return manager.tado
+        with RUN_METRICS.phase("tado_login"):
+            return await asyncio.to_thread(manager.start_login)
 
-        tado.device_activation()
+    started = await asyncio.gather(*(start(manager) for manager in managers), return_exceptions=True)
+    pending = []
+    for (username, password, token_file_path), manager, tado in zip(accounts, managers, started):
+        if isinstance(tado, Exception):
+            logger_.error(f"Login to Tado with {token_file_path} failed with {type(tado).__name__}: {tado}")
+            results[token_file_path] = tado
+        elif tado is manager.tado:
+            results[token_file_path] = tado
+        elif tado.device_activation_status() == "PENDING":
+            pending.append((username, password, token_file_path, manager, tado))
+        else:
+            RUN_METRICS.set_label("tado_login_path", "token")
+            results[token_file_path] = manager.finish_login(tado)
 
-        status = tado.device_activation_status()
+    if pending:
+        logger_.info(f"{len(pending)} Tado accounts need the browser login")
+        RUN_METRICS.set_label("tado_login_path", "browser")
+        with RUN_METRICS.phase("tado_browser_login"):
+            async with BrowserLoginPool(logger_, step_timeout_ms, concurrency) as pool:
+                browser_results = await pool.login_all([(str(tado.device_verification_url()), username, password)
+                                                        for username, password, _, _, tado in pending])
 
-    if status == "COMPLETED":
-        logger_.info(f"Login successful")
-    else:
-        logger_.info(f"Login status is {status}")
+        async def activate(manager: TadoLoginManager, tado: "Tado") -> "Tado":
+            await asyncio.to_thread(tado.device_activation)
+            return manager.finish_login(tado)
 
-    return tado
+        activations = []
+        for (username, _, token_file_path, manager, tado), error in zip(pending, browser_results):
+            if error is not None:
+                logger_.error(f"Browser login to Tado for {username} failed with {type(error).__name__}: {error}")
+                results[token_file_path] = error
+            else:
+                activations.append((token_file_path, activate(manager, tado)))
+        activated = await asyncio.gather(*(activation for _, activation in activations), return_exceptions=True)
+        for (token_file_path, _), tado in zip(activations, activated):
+            results[token_file_path] = tado
+    return results
 
 
 if __name__ == '__main__':
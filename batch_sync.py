@@ -0,0 +1,164 @@
+"""
+This module syncs many Octopus gas meters to their Tado homes in one process.
+The meters are listed in a JSON config file and are synced with bounded parallelism, sharing the Octopus HTTP pools
+and the Tado login sessions of accounts that appear more than once.
+"""
+
+# Built-in modules
+import argparse
+import asyncio
+import json
+import logging
+import re
+
+from consumption_store import DEFAULT_STORE_PATH
+from logging_functions import create_debug_info_console_logger
+from metrics_functions import RUN_METRICS
+from Octopus_Functions import DEFAULT_MAX_WORKERS
+from sync_engine import DEFAULT_CALORIFIC_VALUE, DEFAULT_MAX_ESTIMATED_SHARE
+from sync_octopus_tado import sync
+from TADO_functions import EIQ_METER_FUELS, default_readings_cache_path, get_login_manager, tado_login_accounts
+
+DEFAULT_CONCURRENCY = 4
+REQUIRED_METER_KEYS = ("tado_email", "tado_password", "mprn", "gas_serial_number", "octopus_api_key")
+
+
+def load_batch_config(path: str) -> dict:
+    """
+    Loads and validates the batch config file. The file looks like this:
+    {
+        "concurrency": 4,
+        "meters": [
+            {"name": "Home", "tado_email": "...", "tado_password": "...", "mprn": "...",
+             "gas_serial_number": "...", "octopus_api_key": "...", "tado_home_id": 12345 (optional),
+             "tado_token_file": "optional"}
+        ]
+    }
+    """
+    with open(path, encoding="utf-8") as config_file:
+        config = json.load(config_file)
+    for index, meter in enumerate(config.get("meters", [])):
+        missing = [key for key in REQUIRED_METER_KEYS if not meter.get(key)]
+        if missing:
+            raise ValueError(f"Meter {index} in {path} is missing {', '.join(missing)}")
+        if meter.get("fuel", "gas") not in EIQ_METER_FUELS:
+            raise ValueError(f"Meter {index} in {path} has the fuel {meter['fuel']}, but Tado Energy IQ only takes "
+                             f"{', '.join(EIQ_METER_FUELS)} meter readings")
+    return config
+
+
+def meter_args(meter: dict, config: dict) -> argparse.Namespace:
+    """
+    Builds the same arguments sync() gets from the command line for one meter of the batch config.
+    Every Tado account gets its own token file, so meters of the same account share one login session, and every home
+    of an account its own readings cache.
+    """
+    account = re.sub(r"[^A-Za-z0-9]", "_", meter["tado_email"])
+    home_id = meter.get("tado_home_id")
+    return argparse.Namespace(
+        tado_email=meter["tado_email"],
+        tado_password=meter["tado_password"],
+        tado_home_id=home_id,
+        tado_token_file=meter.get("tado_token_file") or f"tado_refresh_token_{account}",
+        tado_readings_cache=(meter.get("tado_readings_cache")
+                             or default_readings_cache_path(meter["tado_email"], home_id)),
+        tado_readings_max_age=meter.get("tado_readings_max_age", config.get("tado_readings_max_age", 24)),
+        login_screenshot=None,
+        mprn=meter["mprn"],
+        gas_serial_number=meter["gas_serial_number"],
+        fuel=meter.get("fuel", "gas"),
+        octopus_api_key=meter["octopus_api_key"],
+        octopus_concurrency=meter.get("octopus_concurrency", config.get("octopus_concurrency", DEFAULT_MAX_WORKERS)),
+        consumption_store=meter.get("consumption_store", config.get("consumption_store", DEFAULT_STORE_PATH)),
+        catch_up=meter.get("catch_up", config.get("catch_up", False)),
+        consumption_unit=meter.get("consumption_unit", config.get("consumption_unit", "m3")),
+        calorific_value=meter.get("calorific_value", config.get("calorific_value", DEFAULT_CALORIFIC_VALUE)),
+        max_estimated_share=meter.get("max_estimated_share",
+                                      config.get("max_estimated_share", DEFAULT_MAX_ESTIMATED_SHARE)),
+        dry_run=meter.get("dry_run", config.get("dry_run", False)),
+        record=meter.get("record"),
+    )
+
+
+async def sync_batch(config: dict, logger_: logging.Logger = logging.getLogger(), concurrency: int | None = None) -> list:
+    """
+    Syncs every meter in the config, with at most concurrency meters in progress at the same time.
+    A failing meter doesn't stop the others.
+    :return: One summary per meter, in the order of the config
+    """
+    concurrency = concurrency or config.get("concurrency", DEFAULT_CONCURRENCY)
+    semaphore = asyncio.Semaphore(concurrency)
+    meters = config.get("meters", [])
+    arguments = [meter_args(meter, config) for meter in meters]
+
+    # The accounts without a valid Tado token (none stored, or expired) likely need the browser login, so they are
+    # logged in to up front, together in one browser instead of one browser each. Dry runs don't log in.
+    accounts = [(args.tado_email, args.tado_password, args.tado_token_file) for args in arguments
+                if not args.dry_run and not get_login_manager(args.tado_token_file, logger_).has_valid_token()]
+    login_errors = {}
+    if accounts:
+        logins = await tado_login_accounts(accounts, logger_, concurrency=concurrency)
+        for token_file_path, result in logins.items():
+            if isinstance(result, Exception):
+                login_errors[token_file_path] = result
+            elif (status := result.device_activation_status()) != "COMPLETED":
+                login_errors[token_file_path] = RuntimeError(f"the device login didn't complete, its status is "
+                                                             f"{status}")
+
+    async def sync_meter(index: int, meter: dict) -> dict:
+        name = meter.get("name", f"meter-{index}")
+        # A meter whose account couldn't be logged in to fails, instead of starting a browser of its own
+        login_error = login_errors.get(arguments[index].tado_token_file)
+        if login_error is not None:
+            logger_.error(f"Not syncing {name}, the Tado login for {meter['tado_email']} failed")
+            return {"name": name, "mprn": meter["mprn"], "status": "failed",
+                    "error": f"Tado login failed with {type(login_error).__name__}: {login_error}"}
+        async with semaphore:
+            logger_.info(f"Syncing {name} (MPRN: {meter['mprn']})")
+            try:
+                with RUN_METRICS.meter(name):
+                    summary = await sync(arguments[index], logger_)
+            except Exception as ex:
+                logger_.error(f"Syncing {name} failed with {type(ex).__name__}: {ex}")
+                summary = {"mprn": meter["mprn"], "status": "failed", "error": f"{type(ex).__name__}: {ex}"}
+        return {"name": name, **summary}
+
+    return await asyncio.gather(*(sync_meter(index, meter) for index, meter in enumerate(meters)))
+
+
+def parse_args():
+    """
+    Parses command-line arguments for the batch sync
+    """
+    parser = argparse.ArgumentParser(description="Sync many Octopus gas meters to Tado Energy IQ")
+    parser.add_argument("--config", required=True, help="JSON file listing the meters to sync")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help=f"Maximum number of meters synced at the same time (default {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--summary-file", default=None, help="Write the per meter results to this JSON file")
+    parser.add_argument("--metrics-json", default=None, help="Write the timings and counters of the run to this JSON file")
+    parser.add_argument("--metrics-prom", default=None,
+                        help="Write the timings and counters of the run to this file in the Prometheus textfile format")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    log_obj = create_debug_info_console_logger("batch_sync", use_queue=True)
+
+    try:
+        results = asyncio.run(sync_batch(load_batch_config(args.config), log_obj, args.concurrency))
+    finally:
+        if args.metrics_json:
+            RUN_METRICS.write_json(args.metrics_json)
+        if args.metrics_prom:
+            RUN_METRICS.write_prometheus(args.metrics_prom)
+        log_obj.info(f"Run metrics: {RUN_METRICS.to_dict()}")
+    for result in results:
+        submitted = ", ".join(f"{reading['date']}={reading['reading']}" for reading in result.get("readings", []))
+        log_obj.info(f"{result['name']}: {result['status']} {submitted or result.get('error', '')}")
+    if args.summary_file:
+        with open(args.summary_file, "w", encoding="utf-8") as summary_file:
+            json.dump(results, summary_file, indent=2)
+    if any(result["status"] == "failed" for result in results):
+        exit(1)
@@ -0,0 +1,288 @@
+"""
+Benchmarks for the Octopus download, the reconciliation and the end to end sync.
+The Octopus API is replaced by a local stand-in HTTP server replaying half-hourly consumption pages in the same format,
+and Tado by an in-process stand-in replaying the Energy IQ meter readings, so nothing leaves the machine.
+
+Usage:
+    python benchmarks/bench_sync.py --sizes 1d 1y 5y --json bench_results.json
+"""
+
+# Built-in modules
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Octopus_Functions  # noqa: E402
+from consumption_store import ConsumptionStore, to_epoch  # noqa: E402
+from rate_limiter import RATE_LIMITER  # noqa: E402
+from sync_engine import BASELINE_WINDOW, DEFAULT_CALORIFIC_VALUE, DEFAULT_MAX_ESTIMATED_SHARE, SyncEngine  # noqa: E402
+from sync_octopus_tado import sync  # noqa: E402
+
+SIZES = {"1d": 1, "1y": 365, "5y": 5 * 365}
+DEFAULT_PAGE_SIZE = 100
+HALF_HOUR = 30 * 60
+API_KEY = "benchmark"
+SERIAL_NUMBER = "BENCH0001"
+
+
+def generate_consumption(days: int, end: datetime, seed: int = 1) -> tuple[list, list]:
+    """
+    Generates a deterministic half-hourly consumption history of the given length, ending at end
+    :return: The interval start times in epoch seconds and the consumption of each interval
+    """
+    generator = random.Random(seed)
+    first = to_epoch(end) - days * 24 * 2 * HALF_HOUR
+    starts = list(range(first, to_epoch(end), HALF_HOUR))
+    consumption = [round(max(0.0, generator.gauss(0.3, 0.2)), 3) for _ in starts]
+    return starts, consumption
+
+
+def _iso(epoch: int) -> str:
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _bucket(epoch: int, group_by: str) -> tuple[int, int]:
+    """
+    Returns the start and end of the group_by bucket the epoch falls into, on the Europe/London calendar like Octopus
+    """
+    value = datetime.fromtimestamp(epoch, tz=timezone.utc)
+    bucket_start = Octopus_Functions._floor_to_boundary(value, group_by)
+    bucket_end = Octopus_Functions._ceil_to_boundary(bucket_start + timedelta(seconds=1), group_by)
+    return to_epoch(bucket_start), to_epoch(bucket_end)
+
+
+class OctopusStandIn:
+    """This class serves recorded consumption for a few meters the way the Octopus consumption endpoint does"""
+    def __init__(self):
+        self.meters = {}
+        self.pages_served = 0
+        self.bytes_served = 0
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                body = stand_in.page(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with stand_in._lock:
+                    stand_in.pages_served += 1
+                    stand_in.bytes_served += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self) -> "OctopusStandIn":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_meter(self, mprn: str, starts: list, consumption: list):
+        # The JSON of every interval is rendered once, so the server isn't the bottleneck
+        rendered = [f'{{"consumption":{value},"interval_start":"{_iso(start)}","interval_end":"{_iso(start + HALF_HOUR)}"}}'
+                    for start, value in zip(starts, consumption)]
+        self.meters[mprn] = (starts, consumption, rendered)
+
+    def reset_counters(self):
+        with self._lock:
+            self.pages_served = 0
+            self.bytes_served = 0
+
+    def page(self, path: str) -> bytes | None:
+        parsed = urlparse(path)
+        parts = parsed.path.strip("/").split("/")
+        if len(parts) < 5 or parts[-3] != "meters" or parts[-2] != SERIAL_NUMBER or parts[-4] not in self.meters:
+            return None
+        starts, consumption, rendered = self.meters[parts[-4]]
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        first = bisect_left(starts, to_epoch(query["period_from"])) if "period_from" in query else 0
+        last = bisect_left(starts, to_epoch(query["period_to"])) if "period_to" in query else len(starts)
+        page_size = int(query.get("page_size", DEFAULT_PAGE_SIZE))
+        page_number = int(query.get("page", 1))
+
+        group_by = query.get("group_by")
+        if group_by:
+            buckets = {}
+            for index in range(first, last):
+                bucket = _bucket(starts[index], group_by)
+                buckets[bucket] = buckets.get(bucket, 0.0) + consumption[index]
+            results = [f'{{"consumption":{round(value, 3)},"interval_start":"{_iso(start)}","interval_end":"{_iso(end)}"}}'
+                       for (start, end), value in sorted(buckets.items())]
+        else:
+            results = rendered[first:last]
+
+        page = results[(page_number - 1) * page_size:page_number * page_size]
+        next_url = "null"
+        if page_number * page_size < len(results):
+            next_query = dict(query, page=str(page_number + 1))
+            next_url = json.dumps(f"{self.url}{parsed.path}?" + "&".join(f"{key}={value}" for key, value in next_query.items()))
+        return (f'{{"count":{len(results)},"next":{next_url},"previous":null,"results":[' + ",".join(page) + "]}").encode()
+
+
+class TadoStandIn:
+    """This class replays the Energy IQ meter readings of a Tado home and records the submitted readings"""
+    def __init__(self, readings: list):
+        self.readings = readings
+        self.submitted = []
+
+    def get_eiq_meter_readings(self) -> dict:
+        return {"tariffInfo": {}, "readings": list(self.readings)}
+
+    def set_eiq_meter_readings(self, date: str, reading: int) -> dict:
+        self.submitted.append({"date": date, "reading": reading})
+        return {"date": date, "reading": reading}
+
+
+def tado_readings_for(starts: list, consumption: list, now: datetime) -> list:
+    """
+    Builds Tado readings which match the consumption: a baseline at the start of the data (or of the 2 year window)
+    and a last reading 40 days ago, if there is data for it
+    """
+    baseline_epoch = max(starts[0], to_epoch(now - BASELINE_WINDOW))
+    baseline = datetime.fromtimestamp(baseline_epoch, tz=timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0)
+    baseline += timedelta(days=1)
+    readings = [{"date": baseline.strftime("%Y-%m-%d"), "reading": 1000}]
+    last = (now - timedelta(days=40)).replace(hour=0, minute=0, second=0, microsecond=0)
+    if last > baseline:
+        total = sum(consumption[bisect_left(starts, to_epoch(baseline)):bisect_left(starts, to_epoch(last))])
+        readings.append({"date": last.strftime("%Y-%m-%d"), "reading": int(1000 + total)})
+    return readings
+
+
+def peak_rss_mb() -> float:
+    """
+    Returns the peak resident set size of this process so far, in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def measure(name: str, size: str, server: OctopusStandIn, intervals: int, function) -> dict:
+    """
+    Runs function once and returns its timing, with the pages served and intervals processed per second
+    """
+    server.reset_counters()
+    started = time.perf_counter()
+    function()
+    wall_time = time.perf_counter() - started
+    return {
+        "benchmark": name,
+        "size": size,
+        "wall_time_s": round(wall_time, 4),
+        "intervals": intervals,
+        "pages": server.pages_served,
+        "bytes": server.bytes_served,
+        "pages_per_s": round(server.pages_served / wall_time, 1) if wall_time else None,
+        "intervals_per_s": round(intervals / wall_time, 1) if wall_time else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def run_benchmarks(sizes: list, workers: int, logger_: logging.Logger) -> list:
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    results = []
+    with OctopusStandIn() as server, tempfile.TemporaryDirectory() as work_dir:
+        Octopus_Functions.OCTOPUS_API_URL = server.url
+        # The stand-in doesn't throttle, so the rate limiter is opened up to measure the sync itself
+        RATE_LIMITER.set_limit("127.0.0.1", 1e6, 1000)
+        for size in sizes:
+            mprn = f"bench-{size}"
+            starts, consumption = generate_consumption(SIZES[size], now)
+            server.add_meter(mprn, starts, consumption)
+            period_from = datetime.fromtimestamp(starts[0], tz=timezone.utc)
+            period_to = datetime.fromtimestamp(starts[-1] + HALF_HOUR, tz=timezone.utc)
+            intervals = len(starts)
+
+            results.append(measure("get_consumption_between_dates", size, server, intervals, lambda: (
+                Octopus_Functions.get_consumption_between_dates(period_from, period_to, API_KEY, mprn, SERIAL_NUMBER,
+                                                                logger_, max_workers=workers))))
+            results.append(measure("stream_intervals_concurrently", size, server, intervals, lambda: (
+                Octopus_Functions.get_consumption_intervals_concurrently(period_from, period_to, API_KEY, mprn,
+                                                                         SERIAL_NUMBER, logger_, max_workers=workers))))
+
+            # The reconciliation is timed from a preloaded store, with a fresh meter so the index is built every time
+            tado = TadoStandIn(tado_readings_for(starts, consumption, now))
+            store = ConsumptionStore(os.path.join(work_dir, f"{mprn}-reconciliation.sqlite"), logger_)
+            Octopus_Functions.OctopusGasMeter(API_KEY, mprn, SERIAL_NUMBER, store, logger_, workers).update(period_from)
+
+            def reconcile_from_store() -> Octopus_Functions.OctopusMeter:
+                meter = Octopus_Functions.OctopusGasMeter(API_KEY, mprn, SERIAL_NUMBER, store, logger_, workers)
+                SyncEngine(meter, tado, logger_, now=now, catch_up=True).plan()
+                return meter
+
+            indexed = len(reconcile_from_store()._index)
+            results.append(measure("reconciliation", size, server, indexed, reconcile_from_store))
+
+            args = argparse.Namespace(
+                tado_email="bench@example.com", tado_password="", tado_home_id=None, tado_token_file=None,
+                login_screenshot=None, tado_readings_cache=os.path.join(work_dir, f"{mprn}-readings.json"),
+                tado_readings_max_age=24,
+                mprn=mprn, gas_serial_number=SERIAL_NUMBER, fuel="gas", octopus_api_key=API_KEY, octopus_concurrency=workers,
+                consumption_store=os.path.join(work_dir, f"{mprn}.sqlite"), catch_up=True,
+                dry_run=False, record=None, consumption_unit="m3", calorific_value=DEFAULT_CALORIFIC_VALUE,
+                max_estimated_share=DEFAULT_MAX_ESTIMATED_SHARE)
+            results.append(measure("end_to_end_cold", size, server, intervals, lambda: (
+                asyncio.run(sync(args, logger_, tado_factory=lambda: TadoStandIn(tado.readings))))))
+            results.append(measure("end_to_end_warm", size, server, intervals, lambda: (
+                asyncio.run(sync(args, logger_, tado_factory=lambda: TadoStandIn(tado.readings))))))
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the Octopus to Tado sync against local stand-ins")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=list(SIZES),
+                        help="History lengths to benchmark")
+    parser.add_argument("--workers", type=int, default=Octopus_Functions.DEFAULT_MAX_WORKERS,
+                        help="Maximum number of Octopus requests in parallel")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    log_obj = logging.getLogger("bench_sync")
+    log_obj.addHandler(logging.NullHandler())
+    log_obj.propagate = False
+
+    bench_results = run_benchmarks(args.sizes, args.workers, log_obj)
+    columns = ("benchmark", "size", "wall_time_s", "intervals", "pages", "pages_per_s", "intervals_per_s", "peak_rss_mb")
+    print(" | ".join(f"{column:>30}" if index == 0 else f"{column:>15}" for index, column in enumerate(columns)))
+    for result in bench_results:
+        print(" | ".join(f"{str(result[column]):>30}" if index == 0 else f"{str(result[column]):>15}"
+                         for index, column in enumerate(columns)))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as json_file:
+            json.dump(bench_results, json_file, indent=2)
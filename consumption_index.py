@@ -0,0 +1,200 @@
+"""
+This module provides an in-memory index over consumption intervals, so the consumption of any window can be answered
+with two binary searches instead of another pass over the intervals.
+Missing intervals are found while the index is built, and their consumption is estimated from the data around them.
+"""
+
+# Built-in modules
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Iterable
+
+from consumption_store import to_epoch
+
+# The consumption of a gap is estimated from the average rate of this many seconds of data on either side of it
+GAP_NEIGHBOURHOOD = 24 * 60 * 60
+# A gap before the first interval only has data after it, so it is extrapolated from the average rate of this many
+# seconds of data, and not estimated at all if there is less data than that
+MIN_EXTRAPOLATION_SECONDS = 7 * 24 * 60 * 60
+
+
+class InsufficientDataError(ValueError):
+    """There isn't enough consumption data to estimate a gap in it"""
+
+
+class IntervalBuffer:
+    """
+    This class keeps consumption intervals in compact typed arrays instead of one dict per interval.
+    The times are seconds since the epoch.
+    """
+    def __init__(self):
+        self.starts = array("q")
+        self.ends = array("q")
+        self.consumption = array("d")
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def append(self, interval_start: int, interval_end: int, consumption: float):
+        self.starts.append(interval_start)
+        self.ends.append(interval_end)
+        self.consumption.append(consumption)
+
+    def extend(self, other: "IntervalBuffer"):
+        """
+        Appends the intervals of another buffer, skipping any which don't start after the last interval of this one
+        """
+        first = 0
+        if self.starts:
+            first = bisect_left(other.starts, self.starts[-1] + 1)
+        self.starts.extend(other.starts[first:])
+        self.ends.extend(other.ends[first:])
+        self.consumption.extend(other.consumption[first:])
+
+    def rows(self) -> Iterable[tuple[int, int, float]]:
+        """
+        Returns the intervals as (interval_start, interval_end, consumption) rows
+        """
+        return zip(self.starts, self.ends, self.consumption)
+
+
+class ConsumptionIndex:
+    """
+    This class keeps the interval start times and a running total of the consumption in flat arrays.
+    The running total before the i-th interval is cumulative[i], so the consumption of the intervals i to j-1 is
+    cumulative[j] - cumulative[i]. covered[i] is the running total of the interval lengths in the same way.
+    Gaps between intervals, and between period_from and the first interval, are kept with their estimated consumption
+    in the same way, the running total before the i-th gap being gap_cumulative[i]. A gap which can't be estimated
+    counts as 0 and is kept in unestimated_gaps.
+    """
+    def __init__(self, rows: Iterable[tuple[int, int, float]], period_from: datetime | None = None,
+                 period_to: datetime | None = None):
+        """
+        :param rows: (interval_start, interval_end, consumption) rows ordered by interval_start, in epoch seconds
+        :param period_from: The start of the window the rows were loaded for, if known
+        :param period_to: The end of the window the rows were loaded for, if known
+        """
+        self.starts = array("q")
+        self.ends = array("q")
+        self.cumulative = array("d", [0.0])
+        self.covered = array("q", [0])
+        self.period_from = None if period_from is None else to_epoch(period_from)
+        self.period_to = None if period_to is None else to_epoch(period_to)
+        self.gap_starts = array("q")
+        self.gap_ends = array("q")
+        self.unestimated_gaps = []
+        total_consumption = 0.0
+        total_covered = 0
+        previous_end = self.period_from
+        for interval_start, interval_end, consumption in rows:
+            if previous_end is not None and interval_start > previous_end:
+                self.gap_starts.append(previous_end)
+                self.gap_ends.append(interval_start)
+            previous_end = interval_end
+            self.starts.append(interval_start)
+            self.ends.append(interval_end)
+            total_consumption += consumption
+            total_covered += interval_end - interval_start
+            self.cumulative.append(total_consumption)
+            self.covered.append(total_covered)
+
+        self.gap_estimates = array("d", (self._estimate_gap(gap_start, gap_end)
+                                         for gap_start, gap_end in zip(self.gap_starts, self.gap_ends)))
+        self.gap_cumulative = array("d", [0.0])
+        for estimate in self.gap_estimates:
+            self.gap_cumulative.append(self.gap_cumulative[-1] + estimate)
+
+    def _estimate_gap(self, gap_start: int, gap_end: int) -> float:
+        """
+        Estimates the consumption of a gap from the average rate of the intervals within GAP_NEIGHBOURHOOD of it.
+        A gap before the first interval is extrapolated from the first MIN_EXTRAPOLATION_SECONDS of data instead.
+        """
+        if gap_end <= self.starts[0]:
+            enough = bisect_left(self.covered, MIN_EXTRAPOLATION_SECONDS)
+            if enough == len(self.covered):
+                self.unestimated_gaps.append((gap_start, gap_end))
+                return 0.0
+            return self.cumulative[enough] / self.covered[enough] * (gap_end - gap_start)
+        before = bisect_left(self.starts, gap_start - GAP_NEIGHBOURHOOD)
+        after = bisect_left(self.starts, gap_end + GAP_NEIGHBOURHOOD)
+        seconds = self.covered[after] - self.covered[before]
+        if seconds <= 0:
+            return 0.0
+        return (self.cumulative[after] - self.cumulative[before]) / seconds * (gap_end - gap_start)
+
+    @classmethod
+    def from_intervals(cls, intervals: Iterable[dict], period_from: datetime | None = None,
+                       period_to: datetime | None = None) -> "ConsumptionIndex":
+        """
+        Builds the index from intervals as returned by the Octopus API, ordered by interval_start
+        """
+        rows = ((to_epoch(interval["interval_start"]), to_epoch(interval["interval_end"]), interval["consumption"])
+                for interval in intervals)
+        return cls(rows, period_from, period_to)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def covers(self, period_from: datetime, period_to: datetime) -> bool:
+        """
+        Checks whether the index was loaded for a window containing [period_from, period_to)
+        """
+        if self.period_from is None or self.period_to is None:
+            return False
+        return self.period_from <= to_epoch(period_from) and to_epoch(period_to) <= self.period_to
+
+    def total_until(self, value: datetime | int) -> float:
+        """
+        Returns the consumption of all intervals starting before value
+        """
+        epoch = value if isinstance(value, int) else to_epoch(value)
+        return self.cumulative[bisect_left(self.starts, epoch)]
+
+    def consumption_between(self, period_from: datetime, period_to: datetime) -> float:
+        """
+        Returns the consumption of the intervals starting in [period_from, period_to)
+        """
+        return max(0.0, self.total_until(period_to) - self.total_until(period_from))
+
+    def cumulative_consumption(self, period_from: datetime, dates: list[datetime]) -> list[float]:
+        """
+        Returns the consumption from period_from until each of the dates
+        """
+        start_total = self.total_until(period_from)
+        return [max(0.0, self.total_until(date) - start_total) for date in dates]
+
+    def estimated_until(self, value: datetime | int) -> float:
+        """
+        Returns the estimated consumption of the gaps before value, counting the part of a gap value falls into
+        """
+        epoch = value if isinstance(value, int) else to_epoch(value)
+        gap = bisect_right(self.gap_ends, epoch)
+        estimate = self.gap_cumulative[gap]
+        if gap < len(self.gap_starts) and self.gap_starts[gap] < epoch:
+            gap_length = self.gap_ends[gap] - self.gap_starts[gap]
+            estimate += self.gap_estimates[gap] * (epoch - self.gap_starts[gap]) / gap_length
+        return estimate
+
+    def gap_seconds(self) -> int:
+        return sum(gap_end - gap_start for gap_start, gap_end in zip(self.gap_starts, self.gap_ends))
+
+    def reconcile(self, period_from: datetime, dates: list[datetime]) -> list[tuple[float, float]]:
+        """
+        Returns the measured consumption and the estimated consumption of the gaps from period_from until each of the
+        dates. Gaps after the last interval aren't estimated, as that data is usually only late.
+        :raises InsufficientDataError: If a gap in the window can't be estimated
+        """
+        if dates:
+            period_to = max(to_epoch(date) for date in dates)
+            for gap_start, gap_end in self.unestimated_gaps:
+                if gap_start < period_to and to_epoch(period_from) < gap_end:
+                    observed_days = self.covered[-1] / (24 * 60 * 60)
+                    raise InsufficientDataError(
+                        f"There are only {observed_days:.1f} days of Octopus data to estimate the "
+                        f"{(gap_end - gap_start) / (24 * 60 * 60):.1f} days missing before it, at least "
+                        f"{MIN_EXTRAPOLATION_SECONDS // (24 * 60 * 60)} are needed")
+        start_total = self.total_until(period_from)
+        start_estimate = self.estimated_until(period_from)
+        return [(max(0.0, self.total_until(date) - start_total), max(0.0, self.estimated_until(date) - start_estimate))
+                for date in dates]
@@ -0,0 +1,162 @@
+"""
+This module provides a local SQLite store for Octopus Energy consumption intervals, so that history which has already
+been downloaded never needs to be fetched again.
+"""
+
+# Built-in modules
+import logging
+import os
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable
+
+DEFAULT_STORE_PATH = "octopus_consumption.sqlite"
+
+
+def to_epoch(value: datetime | str) -> int:
+    """
+    Converts a datetime or an ISO 8601 string as returned by the Octopus API to seconds since the epoch.
+    Naive datetimes are treated as UTC, the same way the Octopus API treats them.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp())
+
+
+def from_epoch(value: int) -> datetime:
+    """
+    Converts seconds since the epoch to a timezone aware UTC datetime
+    """
+    return datetime.fromtimestamp(value, tz=timezone.utc)
+
+
+class ConsumptionStore:
+    """This class keeps consumption intervals on disk, keyed by meter point and serial number"""
+    def __init__(self, path: str = DEFAULT_STORE_PATH, logger_: logging.Logger = logging.getLogger(),
+                 read_only: bool = False):
+        """
+        :param read_only: Opens an existing store without ever writing to it, e.g. for a dry run
+        """
+        self.path = path
+        self.logger_ = logger_
+        self.read_only = read_only
+        if read_only:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"The consumption store {path} doesn't exist")
+            return
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS consumption ("
+                "meter_point TEXT NOT NULL, "
+                "serial_number TEXT NOT NULL, "
+                "interval_start INTEGER NOT NULL, "
+                "interval_end INTEGER NOT NULL, "
+                "consumption REAL NOT NULL, "
+                "PRIMARY KEY (meter_point, serial_number, interval_start))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS coverage ("
+                "meter_point TEXT NOT NULL, "
+                "serial_number TEXT NOT NULL, "
+                "checked_from INTEGER NOT NULL, "
+                "PRIMARY KEY (meter_point, serial_number))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Opens a new connection, one per operation, so the store can be used from several threads
+        """
+        if self.read_only:
+            return sqlite3.connect(f"{Path(self.path).resolve().as_uri()}?mode=ro", uri=True, timeout=30)
+        return sqlite3.connect(self.path, timeout=30)
+
+    def add_intervals(self, meter_point: str, serial_number: str, intervals: Iterable[dict]) -> int:
+        """
+        Adds intervals as returned by the Octopus API to the store, replacing any interval with the same start.
+        :return: The number of intervals written
+        """
+        return self.add_rows(meter_point, serial_number,
+                             ((to_epoch(interval["interval_start"]), to_epoch(interval["interval_end"]),
+                               interval["consumption"]) for interval in intervals))
+
+    def add_rows(self, meter_point: str, serial_number: str, rows: Iterable[tuple[int, int, float]]) -> int:
+        """
+        Adds (interval_start, interval_end, consumption) rows, with the times in seconds since the epoch, to the store,
+        replacing any interval with the same start.
+        :return: The number of intervals written
+        """
+        rows = [(meter_point, serial_number, interval_start, interval_end, consumption)
+                for interval_start, interval_end, consumption in rows]
+        with self._connect() as connection:
+            connection.executemany("INSERT OR REPLACE INTO consumption VALUES (?, ?, ?, ?, ?)", rows)
+        self.logger_.debug(f"Stored {len(rows)} intervals for {meter_point} / {serial_number}")
+        return len(rows)
+
+    def latest_interval_end(self, meter_point: str, serial_number: str) -> datetime | None:
+        """
+        Returns the end of the newest stored interval, or None if nothing is stored for this meter yet
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT MAX(interval_end) FROM consumption WHERE meter_point = ? AND serial_number = ?",
+                (meter_point, serial_number)).fetchone()
+        return None if row[0] is None else from_epoch(row[0])
+
+    def earliest_interval_start(self, meter_point: str, serial_number: str) -> datetime | None:
+        """
+        Returns the start of the oldest stored interval, or None if nothing is stored for this meter yet
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT MIN(interval_start) FROM consumption WHERE meter_point = ? AND serial_number = ?",
+                (meter_point, serial_number)).fetchone()
+        return None if row[0] is None else from_epoch(row[0])
+
+    def checked_from(self, meter_point: str, serial_number: str) -> datetime | None:
+        """
+        Returns the oldest date the store was filled from, even if Octopus had no data that far back
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT checked_from FROM coverage WHERE meter_point = ? AND serial_number = ?",
+                (meter_point, serial_number)).fetchone()
+        return None if row is None else from_epoch(row[0])
+
+    def set_checked_from(self, meter_point: str, serial_number: str, period_from: datetime):
+        """
+        Records that the store was filled from period_from onwards
+        """
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO coverage VALUES (?, ?, ?)",
+                               (meter_point, serial_number, to_epoch(period_from)))
+
+    def intervals_between(self, meter_point: str, serial_number: str,
+                          period_from: datetime, period_to: datetime) -> list[tuple[int, int, float]]:
+        """
+        Returns the stored (interval_start, interval_end, consumption) rows starting in [period_from, period_to),
+        ordered by interval_start, with the times in seconds since the epoch
+        """
+        with self._connect() as connection:
+            return connection.execute(
+                "SELECT interval_start, interval_end, consumption FROM consumption "
+                "WHERE meter_point = ? AND serial_number = ? AND interval_start >= ? AND interval_start < ? "
+                "ORDER BY interval_start",
+                (meter_point, serial_number, to_epoch(period_from), to_epoch(period_to))).fetchall()
+
+    def consumption_between(self, meter_point: str, serial_number: str,
+                            period_from: datetime, period_to: datetime | None = None) -> float:
+        """
+        Sums the stored consumption for the intervals starting in [period_from, period_to)
+        """
+        query = ("SELECT TOTAL(consumption) FROM consumption "
+                 "WHERE meter_point = ? AND serial_number = ? AND interval_start >= ?")
+        parameters = [meter_point, serial_number, to_epoch(period_from)]
+        if period_to is not None:
+            query += " AND interval_start < ?"
+            parameters.append(to_epoch(period_to))
+        with self._connect() as connection:
+            row = connection.execute(query, parameters).fetchone()
+        return row[0]
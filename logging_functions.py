@@ -4,53 +4,154 @@ This module provides functions to create a logging object that can log to both c
 """
 
 # Built-in modules
+import atexit
+import collections
 import inspect
 import logging
 import logging.handlers
 import os
+import queue
 import threading
 from time import sleep
-# Third-party modules
-import tkinter
+# tkinter is only imported when a Text widget is logged to, it isn't available on every headless host
 
 
 class TextHandler(logging.Handler):
     """This class allows you to log to a Tkinter Text or ScrolledText widget"""
-    def __init__(self, text):
+    def __init__(self, text, batch_interval_ms: int | None = None):
+        """
+        :param text: The Text widget to log to
+        :param batch_interval_ms: If given, messages are only queued by emit, from any thread, and the Tk main loop
+            inserts everything queued every batch_interval_ms milliseconds. Must be created in the Tk thread.
+        """
         # run the regular Handler __init__
         logging.Handler.__init__(self)
         # Store a reference to the Text it will log to
         self.text = text
         self.text.configure(state='normal')
+        self.batch_interval_ms = batch_interval_ms
+        self.pending = collections.deque()
+        if batch_interval_ms is not None:
+            self.text.after(batch_interval_ms, self.flush_pending)
 
     def emit(self, record):
         """This method is called when a log message is emitted"""
         msg = self.format(record)
-        """def append():
-            self.text.configure(state='normal')
-            self.text.insert(tkinter.END, msg + '\n')
-            # self.text.configure(state='disabled')
-            # Autoscroll to the bottom
-            self.text.yview(tkinter.END)
-        # This is necessary because we can't modify the Text from other threads
-        self.text.after(0, append)
-        """
-        
+        if self.batch_interval_ms is not None:
+            # This is necessary because we can't modify the Text from other threads
+            self.pending.append(msg)
+            return
+
+        import tkinter
         self.text.insert(tkinter.END, msg + '\n')
         # Autoscroll to the bottom
         self.text.yview(tkinter.END)
 
+    def flush_pending(self):
+        """This method runs in the Tk main loop and inserts the queued messages with a single insert"""
+        messages = []
+        while self.pending:
+            messages.append(self.pending.popleft())
+        if messages:
+            import tkinter
+            self.text.insert(tkinter.END, '\n'.join(messages) + '\n')
+            # Autoscroll to the bottom
+            self.text.yview(tkinter.END)
+        self.text.after(self.batch_interval_ms, self.flush_pending)
+
+
+class _EnqueueOnlyHandler(logging.handlers.QueueHandler):
+    """This class puts the records on the queue as they are, so all formatting happens in the listener thread"""
+    def prepare(self, record):
+        return record
+
+
+# The running queue listener and the settings of every logger set up by this module, by logger name, so setting up
+# the same logger again doesn't start another listener or add the handlers a second time
+_queue_listeners: dict[str, logging.handlers.QueueListener] = {}
+_logger_settings: dict[str, tuple] = {}
+_setup_lock = threading.RLock()
+
+
+def start_queue_listener(logger_: logging.Logger) -> logging.handlers.QueueListener:
+    """
+    Moves the handlers of the logger behind a queue: the logger is left with a single handler which only enqueues the
+    records, and a background thread formats them and writes them to the original handlers.
+    The listener is stopped, and the queue flushed, when the interpreter exits.
+    :return: The started QueueListener, or the one already running for the logger
+    """
+    with _setup_lock:
+        listener = _queue_listeners.get(logger_.name)
+        if listener is not None:
+            return listener
+        handlers = [handler for handler in logger_.handlers
+                    if not isinstance(handler, logging.handlers.QueueHandler)]
+        for handler in handlers:
+            logger_.removeHandler(handler)
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        logger_.addHandler(_EnqueueOnlyHandler(log_queue))
+        _queue_listeners[logger_.name] = listener
+        return listener
+
 
-def create_debug_info_console_logger(file_str: str) -> logging.Logger:
+def stop_queue_listener(logger_: logging.Logger):
+    """
+    Stops the queue listener of the logger, if it has one, after it has written every queued record.
+    The handlers behind the queue are put back on the logger.
+    """
+    with _setup_lock:
+        listener = _queue_listeners.pop(logger_.name, None)
+        if listener is None:
+            return
+        listener.stop()
+        for handler in [handler for handler in logger_.handlers if isinstance(handler, _EnqueueOnlyHandler)]:
+            logger_.removeHandler(handler)
+        for handler in listener.handlers:
+            logger_.addHandler(handler)
+
+
+def _stop_queue_listeners():
+    with _setup_lock:
+        for name in list(_queue_listeners):
+            stop_queue_listener(logging.getLogger(name))
+
+
+atexit.register(_stop_queue_listeners)
+
+
+def _reset_logger(logger_: logging.Logger, settings: tuple) -> bool:
+    """
+    Prepares the logger to be set up with the settings: stops its queue listener and closes its handlers, unless it
+    is already set up with the same settings. The factory records the settings once the setup has succeeded.
+    :return: True if the logger is already set up with the settings and can be used as it is
+    """
+    if _logger_settings.get(logger_.name) == settings:
+        return True
+    _logger_settings.pop(logger_.name, None)
+    stop_queue_listener(logger_)
+    for handler in list(logger_.handlers):
+        logger_.removeHandler(handler)
+        handler.close()
+    return False
+
+
+def create_debug_info_console_logger(file_str: str, use_queue: bool = False) -> logging.Logger:
     """
     Creates a logging type of object and returns it
     :param file_str: uses thi string to specify what the output file should be named
-    :return: An object of type logging
+    :param use_queue: log calls only enqueue the record and a background thread writes to the console and files
+    :return: An object of type logging, the same one without any new handlers if it is already set up this way
     """
     logger_ = logging.getLogger(__name__)
     try:
         print(inspect.stack()[0][3]) # function_name
         logger_ = logging.getLogger(__name__)
+        with _setup_lock:
+            settings = ("console", file_str, use_queue)
+            if _reset_logger(logger_, settings):
+                return logger_
         logger_.debug("Log object created")
         logger_.setLevel("DEBUG")
 
@@ -75,6 +176,11 @@ def create_debug_info_console_logger(file_str: str) -> logging.Logger:
         debug_timed_rotated_file_handler.setLevel("DEBUG")
         logger_.addHandler(debug_timed_rotated_file_handler)
         logger_.info("Debug file handler added to log object")
+
+        if use_queue:
+            start_queue_listener(logger_)
+            logger_.debug("Handlers moved behind a queue listener")
+        _logger_settings[logger_.name] = settings
     except Exception as ex:
         file_name = os.path.split(inspect.stack()[0][1])[1]
         function_name = inspect.stack()[0][3]
@@ -84,21 +190,27 @@ def create_debug_info_console_logger(file_str: str) -> logging.Logger:
         return logger_
     
 
-def create_console_file_tkinter_logger(file_str: str, tkinter_text) -> logging.Logger:
+def create_console_file_tkinter_logger(file_str: str, tkinter_text, use_queue: bool = False,
+                                       batch_interval_ms: int = 100) -> logging.Logger:
     """
     Creates a logging type of object and returns it
     :param file_str: uses thi string to specify what the output file should be named
-    :return: An object of type logging
+    :param use_queue: log calls only enqueue the record and a background thread writes to the console and files,
+        the Text widget is then updated in batches from the Tk main loop every batch_interval_ms milliseconds
+    :return: An object of type logging, the same one without any new handlers if it is already set up this way
     """
     logger_ = logging.getLogger(__name__)
     try:
         print(inspect.stack()[0][3]) # function_name
         logger_ = logging.getLogger(__name__)
+        with _setup_lock:
+            # Set the logger to use the same thread as the main thread
+            settings = ("tkinter", file_str, tkinter_text, use_queue, batch_interval_ms)
+            if _reset_logger(logger_, settings):
+                return logger_
         logger_.debug("Log object created")
         logger_.setLevel("DEBUG")
 
-        # Set the logger to use the same thread as the main thread
-        logger_.handlers = []  # Clear any existing handlers
         logger_.propagate = False
         logger_.debug("Log object handlers cleared")
         logger_.debug("Log object propagate set to False")
@@ -180,7 +292,7 @@ def create_console_file_tkinter_logger(file_str: str, tkinter_text) -> logging.L
         logger_.debug("Debug file handler set to main thread")
 
         # Create info text handler
-        text_handler = TextHandler(tkinter_text)
+        text_handler = TextHandler(tkinter_text, batch_interval_ms if use_queue else None)
         text_handler.setFormatter(clean_formatter)  # Set the formatter to only show the message
         text_handler.setLevel("INFO")  # Set the level to DEBUG or INFO as needed
         # Set the file handler to use the same thread as the main thread
@@ -192,6 +304,11 @@ def create_console_file_tkinter_logger(file_str: str, tkinter_text) -> logging.L
         logger_.addHandler(text_handler)
         logger_.info("Info Text_handler added to log object")
 
+        if use_queue:
+            start_queue_listener(logger_)
+            logger_.debug("Handlers moved behind a queue listener")
+        _logger_settings[logger_.name] = settings
+
     except Exception as ex:
         file_name = os.path.split(inspect.stack()[0][1])[1]
         function_name = inspect.stack()[0][3]
@@ -215,6 +332,8 @@ def test():
 
 # Sample usage
 if __name__ == '__main__':
+    import tkinter
+
     # Create the GUI
     root = tkinter.Tk()
     
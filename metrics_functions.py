@@ -0,0 +1,207 @@
+"""
+This module collects timings and counters of a sync run, so a slow run can be traced to the Tado login,
+the Octopus download or the submission without re-running it with DEBUG logging.
+The summary can be written as JSON or in the Prometheus textfile collector format.
+A batch run keeps the metrics of every meter apart as well, see RunMetrics.meter.
+"""
+
+# Built-in modules
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+METRIC_PREFIX = "octopus_tado_sync"
+
+# The meter the running code syncs, set by RunMetrics.meter. asyncio tasks and asyncio.to_thread copy it, and the
+# Octopus thread pools run each download in a copy of the caller's context.
+_current_meter: contextvars.ContextVar[str | None] = contextvars.ContextVar("metrics_meter", default=None)
+
+
+class RunMetrics:
+    """This class accumulates the phase timings, Octopus page statistics and counters of a run, from any thread"""
+    def __init__(self, per_meter: bool = True):
+        """
+        :param per_meter: Whether metrics recorded inside RunMetrics.meter are also kept apart for that meter
+        """
+        self._lock = threading.Lock()
+        self.per_meter = per_meter
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets everything recorded so far, to start a new run
+        """
+        with self._lock:
+            self.started_at = datetime.now()
+            self.finished_at = None
+            self.phases = {}
+            self.counters = {}
+            self.labels = {}
+            self.octopus_pages = {"pages": 0, "page_seconds": 0.0, "page_max_seconds": 0.0, "bytes": 0, "intervals": 0}
+            self.meters = {}
+
+    @contextmanager
+    def meter(self, name: str):
+        """
+        Keeps the metrics recorded in the with block (and the tasks and threads it starts) for the meter as well as
+        for the whole run. Labels are only kept for the meter, so the meters of a batch don't overwrite each other's.
+        """
+        with self._lock:
+            metrics = self.meters.get(name)
+            if metrics is None:
+                metrics = self.meters[name] = RunMetrics(per_meter=False)
+        token = _current_meter.set(name)
+        try:
+            yield metrics
+        finally:
+            _current_meter.reset(token)
+            metrics.finished_at = datetime.now()
+
+    def _meter_metrics(self) -> "RunMetrics | None":
+        """
+        Returns the metrics of the meter the running code syncs, if any
+        """
+        name = _current_meter.get()
+        if not self.per_meter or name is None:
+            return None
+        with self._lock:
+            return self.meters.get(name)
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Times the code in the with block as one occurrence of the phase
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_phase(name, time.perf_counter() - started)
+
+    def record_phase(self, name: str, seconds: float):
+        meter_metrics = self._meter_metrics()
+        if meter_metrics is not None:
+            meter_metrics.record_phase(name, seconds)
+        with self._lock:
+            phase = self.phases.setdefault(name, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            phase["count"] += 1
+            phase["seconds"] += seconds
+            phase["max_seconds"] = max(phase["max_seconds"], seconds)
+
+    def record_page(self, seconds: float, bytes_: int, intervals: int):
+        """
+        Records one Octopus page: how long it took, its size and the number of intervals in it
+        """
+        meter_metrics = self._meter_metrics()
+        if meter_metrics is not None:
+            meter_metrics.record_page(seconds, bytes_, intervals)
+        with self._lock:
+            self.octopus_pages["pages"] += 1
+            self.octopus_pages["page_seconds"] += seconds
+            self.octopus_pages["page_max_seconds"] = max(self.octopus_pages["page_max_seconds"], seconds)
+            self.octopus_pages["bytes"] += bytes_
+            self.octopus_pages["intervals"] += intervals
+
+    def increment(self, name: str, value: float = 1):
+        meter_metrics = self._meter_metrics()
+        if meter_metrics is not None:
+            meter_metrics.increment(name, value)
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_label(self, name: str, value: str):
+        """
+        Records a fact about the run, e.g. which way Tado was logged in to, or about the meter inside RunMetrics.meter
+        """
+        meter_metrics = self._meter_metrics()
+        if meter_metrics is not None:
+            meter_metrics.set_label(name, value)
+            return
+        with self._lock:
+            self.labels[name] = value
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            summary = {
+                "started_at": self.started_at.isoformat(),
+                "wall_seconds": ((self.finished_at or datetime.now()) - self.started_at).total_seconds(),
+                "phases": {name: dict(phase) for name, phase in self.phases.items()},
+                "octopus_pages": dict(self.octopus_pages),
+                "counters": dict(self.counters),
+                "labels": dict(self.labels),
+            }
+            meters = dict(self.meters)
+        if meters:
+            summary["meters"] = {name: metrics.to_dict() for name, metrics in meters.items()}
+        return summary
+
+    def to_prometheus(self) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format. The metrics of each meter of a batch are
+        repeated with a meter label.
+        """
+        summary = self.to_dict()
+        families = {}
+
+        def add(name: str, labels: dict, value):
+            families.setdefault(name, []).append((labels, value))
+
+        def add_summary(summary_: dict, labels: dict):
+            add("wall_seconds", labels, summary_["wall_seconds"])
+            for name, phase in summary_["phases"].items():
+                add("phase_seconds", {**labels, "phase": name}, phase["seconds"])
+            for name, phase in summary_["phases"].items():
+                add("phase_count", {**labels, "phase": name}, phase["count"])
+            for name, value in summary_["octopus_pages"].items():
+                add(f"octopus_{name}", labels, value)
+            for name, value in summary_["counters"].items():
+                add(name, labels, value)
+            if summary_["labels"]:
+                add("info", {**labels, **summary_["labels"]}, 1)
+
+        add_summary(summary, {})
+        for meter, meter_summary in summary.get("meters", {}).items():
+            add_summary(meter_summary, {"meter": meter})
+
+        lines = []
+        for name, samples in families.items():
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+            for labels, value in samples:
+                if labels:
+                    rendered = ",".join(f'{label}="{_escape_label(str(label_value))}"'
+                                        for label, label_value in labels.items())
+                    lines.append(f"{METRIC_PREFIX}_{name}{{{rendered}}} {value}")
+                else:
+                    lines.append(f"{METRIC_PREFIX}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str):
+        _write_atomically(path, json.dumps(self.to_dict(), indent=2))
+
+    def write_prometheus(self, path: str):
+        _write_atomically(path, self.to_prometheus())
+
+
+def _escape_label(value: str) -> str:
+    """
+    Escapes a Prometheus label value, e.g. a meter name from the batch config
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomically(path: str, content: str):
+    """
+    Writes the file through a temporary file, so a collector never reads a half written file
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as output_file:
+        output_file.write(content)
+    os.replace(temporary_path, path)
+
+
+# The metrics of the current run, shared by every module
+RUN_METRICS = RunMetrics()
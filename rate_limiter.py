@@ -0,0 +1,159 @@
+"""
+This module paces the outbound requests to Octopus and Tado with a token bucket per host, shared by every meter and
+account synced by the process, so raising the concurrency doesn't get the runs throttled.
+A 429 response slows the host down (and pauses it for the Retry-After time), and the rate recovers step by step
+with every successful response.
+"""
+
+# Built-in modules
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+# Third-party modules
+import requests
+
+from metrics_functions import RUN_METRICS
+
+# Requests per second and burst size per host. Tado allows few requests per day, so it is kept slow.
+DEFAULT_LIMITS = {
+    "api.octopus.energy": (5.0, 10),
+    "login.tado.com": (1.0, 3),
+    "my.tado.com": (1.0, 5),
+    "energy-insights.tado.com": (1.0, 5),
+}
+# The limit of any other host, e.g. a local stand-in server
+DEFAULT_LIMIT = (20.0, 20)
+# A 429 divides the rate by this much, and every successful response adds this share of the configured rate back
+BACKOFF_FACTOR = 2.0
+RECOVERY_STEP = 0.1
+MIN_RATE = 0.05
+
+
+class TokenBucket:
+    """This class hands out one token per request at up to rate tokens per second, with bursts of up to capacity"""
+    def __init__(self, rate: float, capacity: int):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Takes a token, going into debt if there are none left
+        :return: How many seconds the caller has to wait before using the token
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens) / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def throttle(self, retry_after: float | None = None):
+        """
+        Slows the bucket down after a 429 and pauses it for retry_after seconds, if given
+        """
+        with self._lock:
+            self.rate = max(MIN_RATE, self.rate / BACKOFF_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def recover(self):
+        """
+        Moves the rate back towards the configured one after a successful response
+        """
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_STEP)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Parses a Retry-After header, which is either a number of seconds or an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """This class keeps a token bucket per host and records how long requests waited for a token"""
+    def __init__(self, limits: dict[str, tuple[float, int]] | None = None,
+                 default_limit: tuple[float, int] = DEFAULT_LIMIT):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.default_limit = default_limit
+        self._buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def set_limit(self, host: str, rate: float, burst: int):
+        """
+        Changes the limit of a host, starting with a full bucket
+        """
+        with self._lock:
+            self.limits[host] = (rate, burst)
+            self._buckets.pop(host, None)
+
+    def bucket(self, host: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(*self.limits.get(host, self.default_limit))
+                self._buckets[host] = bucket
+            return bucket
+
+    def acquire(self, url: str) -> float:
+        """
+        Waits until a request to the host of url may be sent
+        :return: The seconds waited
+        """
+        wait = self.bucket(urlparse(url).hostname or "").reserve()
+        if wait > 0:
+            RUN_METRICS.increment("rate_limit_delayed_requests")
+            RUN_METRICS.increment("rate_limit_wait_seconds", wait)
+            time.sleep(wait)
+        return wait
+
+    def report(self, url: str, response: requests.Response):
+        """
+        Adapts the rate of the host to the response: a 429, also one that was retried by urllib3 on the way, slows it
+        down and any other response lets it recover
+        """
+        retries = getattr(response.raw, "retries", None)
+        retried_429 = retries is not None and any(attempt.status == 429 for attempt in retries.history)
+        bucket = self.bucket(urlparse(url).hostname or "")
+        if response.status_code == 429 or retried_429:
+            RUN_METRICS.increment("rate_limited_responses")
+            bucket.throttle(parse_retry_after(response.headers.get("Retry-After")) if response.status_code == 429 else None)
+        else:
+            bucket.recover()
+
+
+class RateLimitedSession(requests.Session):
+    """This class is a requests session which sends every request through the shared rate limiter"""
+    def __init__(self, limiter: "RateLimiter | None" = None):
+        super().__init__()
+        self.limiter = limiter or RATE_LIMITER
+
+    def send(self, request, **kwargs):
+        self.limiter.acquire(request.url)
+        response = super().send(request, **kwargs)
+        self.limiter.report(request.url, response)
+        return response
+
+
+# The limiter shared by every Octopus and Tado session of the process
+RATE_LIMITER = RateLimiter()
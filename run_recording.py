@@ -0,0 +1,181 @@
+"""
+This module records the inputs of a sync run, the Tado meter readings and the Octopus intervals the reconciliation
+used, so the run can be replayed offline: the plan is worked out again without contacting Octopus or Tado and
+compared to the recorded one. A change to the reconciliation can be checked against many recorded meters in seconds.
+
+Usage:
+    python sync_octopus_tado.py ... --dry-run --record recordings/home.json
+    python run_recording.py recordings/*.json --summary-file replay.json
+"""
+
+# Built-in modules
+import argparse
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Iterable
+
+from consumption_index import ConsumptionIndex
+from logging_functions import create_debug_info_console_logger
+from sync_engine import DEFAULT_CALORIFIC_VALUE, DEFAULT_MAX_ESTIMATED_SHARE, SyncEngine, SyncPlan
+
+RECORDING_VERSION = 1
+
+
+class RecordedConsumption:
+    """This class answers the consumption questions of the sync engine from recorded intervals"""
+    def __init__(self, rows: Iterable[tuple[int, int, float]], period_from: datetime, period_to: datetime):
+        self.index = ConsumptionIndex(rows, period_from, period_to)
+
+    def update(self, period_from: datetime) -> int:
+        return 0
+
+    def consumption_between(self, period_from: datetime, period_to: datetime) -> float:
+        return self.index.consumption_between(period_from, period_to)
+
+    def cumulative_consumption(self, period_from: datetime, dates: list[datetime]) -> list[float]:
+        return self.index.cumulative_consumption(period_from, dates)
+
+    def reconciled_consumption(self, period_from: datetime, dates: list[datetime]) -> list[tuple[float, float]]:
+        return self.index.reconcile(period_from, dates)
+
+
+class RecordedTado:
+    """This class replays recorded Energy IQ meter readings and keeps the submitted readings instead of sending them"""
+    def __init__(self, meter_readings: dict):
+        self.meter_readings = meter_readings
+        self.submitted = []
+
+    def get_eiq_meter_readings(self) -> dict:
+        return {**self.meter_readings, "readings": list(self.meter_readings["readings"])}
+
+    def set_eiq_meter_readings(self, date: str, reading: int) -> dict:
+        self.submitted.append({"date": date, "reading": reading})
+        return {"date": date, "reading": reading}
+
+
+@dataclass
+class RunRecording:
+    """Everything the reconciliation of one run was based on, and the plan it came to"""
+    mprn: str
+    serial_number: str
+    now: datetime
+    catch_up: bool
+    meter_readings: dict
+    period_from: datetime
+    period_to: datetime
+    intervals: list[tuple[int, int, float]] = field(default_factory=list)
+    plan: dict = field(default_factory=dict)
+    fuel: str = "gas"
+    consumption_unit: str = "m3"
+    calorific_value: float = DEFAULT_CALORIFIC_VALUE
+    max_estimated_share: float = DEFAULT_MAX_ESTIMATED_SHARE
+    completed_days_only: bool = False
+
+    def to_dict(self) -> dict:
+        return {
+            "version": RECORDING_VERSION,
+            "mprn": self.mprn,
+            "serial_number": self.serial_number,
+            "fuel": self.fuel,
+            "now": self.now.isoformat(),
+            "catch_up": self.catch_up,
+            "consumption_unit": self.consumption_unit,
+            "calorific_value": self.calorific_value,
+            "max_estimated_share": self.max_estimated_share,
+            "completed_days_only": self.completed_days_only,
+            "meter_readings": self.meter_readings,
+            "period_from": self.period_from.isoformat(),
+            "period_to": self.period_to.isoformat(),
+            "intervals": [list(row) for row in self.intervals],
+            "plan": self.plan,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RunRecording":
+        if data.get("version") != RECORDING_VERSION:
+            raise ValueError(f"Unsupported recording version {data.get('version')}, expected {RECORDING_VERSION}")
+        return cls(
+            mprn=data["mprn"],
+            serial_number=data["serial_number"],
+            now=datetime.fromisoformat(data["now"]),
+            catch_up=data["catch_up"],
+            meter_readings=data["meter_readings"],
+            period_from=datetime.fromisoformat(data["period_from"]),
+            period_to=datetime.fromisoformat(data["period_to"]),
+            intervals=[tuple(row) for row in data["intervals"]],
+            plan=data["plan"],
+            fuel=data.get("fuel", "gas"),
+            consumption_unit=data.get("consumption_unit", "m3"),
+            calorific_value=data.get("calorific_value", DEFAULT_CALORIFIC_VALUE),
+            max_estimated_share=data.get("max_estimated_share", DEFAULT_MAX_ESTIMATED_SHARE),
+            completed_days_only=data.get("completed_days_only", False),
+        )
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as recording_file:
+            json.dump(self.to_dict(), recording_file)
+
+    @classmethod
+    def load(cls, path: str) -> "RunRecording":
+        with open(path, encoding="utf-8") as recording_file:
+            return cls.from_dict(json.load(recording_file))
+
+
+def record_run(meter, engine: SyncEngine, meter_readings: dict, plan: SyncPlan, period_from: datetime) -> RunRecording:
+    """
+    Records a run from the meter and the engine it used, see Octopus_Functions.OctopusMeter
+    :param period_from: The start of the consumption the plan is based on, the baseline date if there is one
+    """
+    now = engine.current_time()
+    return RunRecording(meter.meter_point, meter.serial_number, now, engine.catch_up, meter_readings, period_from, now,
+                        list(meter.intervals_between(period_from, now)), plan.to_dict(), meter.fuel,
+                        engine.consumption_unit, engine.calorific_value, engine.max_estimated_share,
+                        engine.completed_days_only)
+
+
+def replay(recording: RunRecording, logger_: logging.Logger = logging.getLogger()) -> dict:
+    """
+    Works out the plan of a recorded run again and submits it to a stand-in which only keeps the readings
+    :return: A summary like the one of sync(), with the readings the stand-in got and whether the plan matches
+    """
+    tado = RecordedTado(recording.meter_readings)
+    consumption = RecordedConsumption(recording.intervals, recording.period_from, recording.period_to)
+    engine = SyncEngine(consumption, tado, logger_, now=recording.now, catch_up=recording.catch_up,
+                        consumption_unit=recording.consumption_unit, calorific_value=recording.calorific_value,
+                        max_estimated_share=recording.max_estimated_share,
+                        completed_days_only=recording.completed_days_only)
+    plan = engine.plan(recording.meter_readings)
+    engine.execute(plan)
+    return {"mprn": recording.mprn, "status": "rejected" if plan.errors else "planned",
+            "matches": plan.to_dict() == recording.plan, "submitted": tado.submitted, **plan.to_dict()}
+
+
+def parse_args():
+    """
+    Parses command-line arguments for replaying recorded runs
+    """
+    parser = argparse.ArgumentParser(description="Replay recorded sync runs offline and compare their plans")
+    parser.add_argument("recordings", nargs="+", help="Recording files written with --record")
+    parser.add_argument("--summary-file", default=None, help="Write the per recording results to this JSON file")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    log_obj = create_debug_info_console_logger("run_recording")
+
+    results = []
+    for recording_path in args.recordings:
+        result = {"recording": recording_path, **replay(RunRecording.load(recording_path), log_obj)}
+        submitted = ", ".join(f"{reading['date']}={reading['reading']}" for reading in result["readings"])
+        log_obj.info(f"{recording_path}: {result['status']}, {'matches' if result['matches'] else 'DIFFERS from'} "
+                     f"the recorded plan {submitted}")
+        results.append(result)
+    if args.summary_file:
+        with open(args.summary_file, "w", encoding="utf-8") as summary_file:
+            json.dump(results, summary_file, indent=2)
+    if not all(result["matches"] for result in results):
+        exit(1)
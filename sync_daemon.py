@@ -0,0 +1,189 @@
+"""
+This module keeps the sync running as a resident service, instead of a cold start of sync_octopus_tado.py per run.
+The Tado login session, the Octopus HTTP pools, the consumption store, the consumption index and the Tado readings
+cache stay warm between runs, so a frequent sync only costs the incremental Octopus download of the intervals since
+the previous run. Today's reading is worked out from the completed days only, and it is only submitted again when it
+changes, i.e. when Octopus data for another day arrives.
+A small HTTP server reports the health of the service and the metrics of the last run.
+"""
+
+# Built-in modules
+import argparse
+import asyncio
+import json
+import logging
+import re
+import signal
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from logging_functions import create_debug_info_console_logger
+from metrics_functions import RUN_METRICS
+from sync_octopus_tado import create_sync_state, parse_args, sync
+
+DEFAULT_INTERVAL = "1d"
+DEFAULT_HEALTH_HOST = "127.0.0.1"
+DEFAULT_HEALTH_PORT = 8080
+INTERVAL_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_interval(value: str) -> timedelta:
+    """
+    Parses a sync interval like 30m, 1h or 1d. A plain number is a number of seconds.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*", value)
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid interval {value!r}, use e.g. 30m, 1h or 1d")
+    interval = timedelta(seconds=float(match.group(1)) * INTERVAL_UNITS[match.group(2) or "s"])
+    if interval <= timedelta(0):
+        raise argparse.ArgumentTypeError(f"The interval must be longer than 0 seconds")
+    return interval
+
+
+class SyncDaemon:
+    """This class runs the sync on a fixed interval until it is stopped, and keeps the status of the runs"""
+    def __init__(self, args, interval: timedelta, logger_: logging.Logger = logging.getLogger()):
+        self.args = args
+        self.interval = interval
+        self.logger_ = logger_
+        self.stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.last_run_at = None
+        self.last_success_at = None
+        self.last_result = None
+        self.next_run_at = None
+        self.last_metrics = ""
+        self.state = None
+
+    def run_once(self) -> dict:
+        """
+        Runs one sync, records its outcome and writes its metrics files (if configured)
+        """
+        RUN_METRICS.reset()
+        started_at = datetime.now()
+        try:
+            if self.state is None:
+                self.state = create_sync_state(self.args, self.logger_)
+            result = asyncio.run(sync(self.args, self.logger_, state=self.state, completed_days_only=True))
+        except Exception as ex:
+            self.logger_.error(f"Sync failed with {type(ex).__name__}: {ex}")
+            result = {"mprn": self.args.mprn, "status": "failed", "error": f"{type(ex).__name__}: {ex}"}
+        finally:
+            if self.args.metrics_json:
+                RUN_METRICS.write_json(self.args.metrics_json)
+            if self.args.metrics_prom:
+                RUN_METRICS.write_prometheus(self.args.metrics_prom)
+
+        with self._lock:
+            self.runs += 1
+            self.last_run_at = started_at
+            self.last_result = result
+            self.last_metrics = RUN_METRICS.to_prometheus()
+            if result["status"] == "failed":
+                self.failures += 1
+            else:
+                self.last_success_at = started_at
+        self.logger_.info(f"Sync finished with status {result['status']}, run metrics: {RUN_METRICS.to_dict()}")
+        return result
+
+    def run_forever(self):
+        """
+        Runs the sync straight away and then every interval, until stop() is called
+        """
+        while not self.stop_event.is_set():
+            self.run_once()
+            with self._lock:
+                self.next_run_at = datetime.now() + self.interval
+            self.logger_.info(f"Next sync at {self.next_run_at}")
+            self.stop_event.wait(self.interval.total_seconds())
+        self.logger_.info(f"Sync daemon stopped")
+
+    def stop(self, *_):
+        self.logger_.info(f"Stopping the sync daemon")
+        self.stop_event.set()
+
+    def health(self) -> dict:
+        """
+        Returns the status of the daemon. It is healthy until a run fails, and again after the next successful run.
+        """
+        with self._lock:
+            healthy = self.last_result is None or self.last_result["status"] != "failed"
+            return {
+                "status": "ok" if healthy else "failing",
+                "runs": self.runs,
+                "failures": self.failures,
+                "interval_seconds": self.interval.total_seconds(),
+                "last_run_at": self.last_run_at and self.last_run_at.isoformat(),
+                "last_success_at": self.last_success_at and self.last_success_at.isoformat(),
+                "next_run_at": self.next_run_at and self.next_run_at.isoformat(),
+                "last_result": self.last_result,
+            }
+
+    def health_server(self, host: str, port: int) -> ThreadingHTTPServer:
+        """
+        Returns an HTTP server answering /health with the status as JSON (503 when the last run failed)
+        and /metrics with the metrics of the last run in the Prometheus text format
+        """
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/health":
+                    health = daemon.health()
+                    status_code = 200 if health["status"] == "ok" else 503
+                    body, content_type = json.dumps(health).encode(), "application/json"
+                elif self.path == "/metrics":
+                    with daemon._lock:
+                        body = daemon.last_metrics.encode()
+                    status_code, content_type = 200, "text/plain; version=0.0.4"
+                else:
+                    status_code, body, content_type = 404, b"", "text/plain"
+                self.send_response(status_code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                daemon.logger_.debug(f"Health endpoint: {format % args}")
+
+        return ThreadingHTTPServer((host, port), Handler)
+
+
+def parse_daemon_args():
+    """
+    Parses the arguments of sync_octopus_tado.py plus the schedule and the health endpoint of the daemon
+    """
+    parser = argparse.ArgumentParser(description="Keep syncing Octopus gas consumption to Tado Energy IQ")
+    parser.add_argument("--interval", type=parse_interval, default=parse_interval(DEFAULT_INTERVAL),
+                        help=f"Time between syncs, e.g. 30m, 1h or 1d (default {DEFAULT_INTERVAL})")
+    parser.add_argument("--health-host", default=DEFAULT_HEALTH_HOST,
+                        help=f"Address the health endpoint listens on (default {DEFAULT_HEALTH_HOST})")
+    parser.add_argument("--health-port", type=int, default=DEFAULT_HEALTH_PORT,
+                        help=f"Port of the health endpoint, 0 disables it (default {DEFAULT_HEALTH_PORT})")
+    return parse_args(parser)
+
+
+if __name__ == "__main__":
+    args = parse_daemon_args()
+
+    log_obj = create_debug_info_console_logger("sync_daemon", use_queue=True)
+
+    sync_daemon = SyncDaemon(args, args.interval, log_obj)
+    signal.signal(signal.SIGTERM, sync_daemon.stop)
+    signal.signal(signal.SIGINT, sync_daemon.stop)
+
+    server = None
+    if args.health_port:
+        server = sync_daemon.health_server(args.health_host, args.health_port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        log_obj.info(f"Health endpoint on http://{args.health_host}:{server.server_address[1]}/health")
+    try:
+        sync_daemon.run_forever()
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,309 @@
+"""
+This module holds the reconciliation between the Octopus consumption and the Tado Energy IQ meter readings.
+The engine works out a plan of the readings to submit separately from submitting them, and the Octopus and Tado
+clients are passed in, so it can be reused by the command line script, the batch runner or a long running process.
+"""
+
+# Built-in modules
+import calendar
+import logging
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Protocol
+
+from consumption_index import InsufficientDataError
+from metrics_functions import RUN_METRICS
+
+# The oldest Tado reading used as the baseline is about 2 years old, as Octopus doesn't keep data for longer
+BASELINE_WINDOW = timedelta(days=2*365 - 30)
+
+# SMETS1 gas meters report kWh to Octopus, while the meter and Tado count m³:
+# m³ = kWh * 3.6 MJ/kWh / (calorific value in MJ/m³ * volume correction)
+CONSUMPTION_UNITS = ("m3", "kwh")
+DEFAULT_CALORIFIC_VALUE = 39.5
+VOLUME_CORRECTION = 1.02264
+MJ_PER_KWH = 3.6
+# Readings whose consumption is estimated for more than this share are not submitted
+DEFAULT_MAX_ESTIMATED_SHARE = 0.2
+
+
+class ConsumptionSource(Protocol):
+    """The Octopus side of the sync, see Octopus_Functions.OctopusMeter"""
+    def update(self, period_from: datetime) -> int: ...
+
+    def consumption_between(self, period_from: datetime, period_to: datetime) -> float: ...
+
+    def cumulative_consumption(self, period_from: datetime, dates: list[datetime]) -> list[float]: ...
+
+    def reconciled_consumption(self, period_from: datetime, dates: list[datetime]) -> list[tuple[float, float]]: ...
+
+
+class MeterReadingClient(Protocol):
+    """The Tado side of the sync, a PyTado Tado object fits it"""
+    def get_eiq_meter_readings(self) -> dict: ...
+
+    def set_eiq_meter_readings(self, date: str, reading: int) -> dict: ...
+
+
+@dataclass
+class PlannedReading:
+    """
+    A meter reading which should be submitted to Tado. The consumption is in the unit of the meter, and estimated is
+    the part of it estimated for gaps in the Octopus data. The confidence is measured when nothing was estimated.
+    """
+    date: datetime
+    reading: int
+    consumption: float
+    estimated: float = 0.0
+    confidence: str = "measured"
+
+    def to_dict(self) -> dict:
+        return {"date": self.date.strftime('%Y-%m-%d'), "reading": self.reading, "consumption": self.consumption,
+                "estimated": self.estimated, "confidence": self.confidence}
+
+
+@dataclass
+class SyncPlan:
+    """The result of the reconciliation: the baseline it is based on and the readings to submit"""
+    baseline_date: datetime | None
+    baseline_reading: int | None
+    last_date: datetime | None
+    last_reading: int | None
+    readings: list[PlannedReading] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "baseline_date": self.baseline_date and self.baseline_date.strftime('%Y-%m-%d'),
+            "baseline_reading": self.baseline_reading,
+            "last_date": self.last_date and self.last_date.strftime('%Y-%m-%d'),
+            "last_reading": self.last_reading,
+            "readings": [reading.to_dict() for reading in self.readings],
+            "errors": self.errors,
+        }
+
+
+def parse_reading_date(value: str) -> datetime:
+    """
+    Parses the YYYY-MM-DD date of a Tado meter reading
+    """
+    return datetime(year=int(value[:4]), month=int(value[5:7]), day=int(value[8:10]))
+
+
+class ReadingIndex:
+    """This class keeps the Tado meter readings sorted by date, so they can be looked up with a binary search"""
+    def __init__(self, meter_readings: dict):
+        """
+        :param meter_readings: The response of get_eiq_meter_readings
+        """
+        readings = sorted((parse_reading_date(reading["date"]), reading["reading"])
+                          for reading in meter_readings["readings"])
+        self.dates = [date for date, _ in readings]
+        self.readings = [reading for _, reading in readings]
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def latest(self) -> tuple[datetime, int] | None:
+        """
+        Returns the date and value of the newest reading
+        """
+        if not self.dates:
+            return None
+        return self.dates[-1], self.readings[-1]
+
+    def reading_on(self, value: datetime) -> int | None:
+        """
+        Returns the value of the reading on the day of value, if Tado has one
+        """
+        day = datetime.combine(value.date(), datetime.min.time())
+        position = bisect_left(self.dates, day)
+        if position < len(self.dates) and self.dates[position].date() == value.date():
+            return self.readings[position]
+        return None
+
+    def first_on_or_after(self, value: datetime) -> tuple[datetime, int] | None:
+        """
+        Returns the date and value of the oldest reading which is not before value
+        """
+        position = bisect_left(self.dates, value)
+        if position == len(self.dates):
+            return None
+        return self.dates[position], self.readings[position]
+
+
+def kwh_to_cubic_metres(kwh: float, calorific_value: float = DEFAULT_CALORIFIC_VALUE) -> float:
+    """
+    Converts gas consumption in kWh to m³
+    :param calorific_value: The calorific value of the gas in MJ/m³, shown on the gas bill
+    """
+    return kwh * MJ_PER_KWH / (calorific_value * VOLUME_CORRECTION)
+
+
+def add_months(value: datetime, months: int, day: int | None = None) -> datetime:
+    """
+    Moves a date by whole months, keeping the day of the month (or the given day) where the month is long enough
+    and using the last day of the month where it isn't, e.g. 31 January + 1 month is 28 or 29 February
+    """
+    month_index = value.year * 12 + value.month - 1 + months
+    year, month = month_index // 12, month_index % 12 + 1
+    day = min(day or value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+
+class SyncEngine:
+    """This class works out which readings to submit to Tado from the Octopus consumption, and submits them"""
+    def __init__(self, consumption_source: ConsumptionSource, tado_client: MeterReadingClient,
+                 logger_: logging.Logger = logging.getLogger(), now: datetime | None = None, catch_up: bool = False,
+                 consumption_unit: str = "m3", calorific_value: float = DEFAULT_CALORIFIC_VALUE,
+                 max_estimated_share: float = DEFAULT_MAX_ESTIMATED_SHARE, completed_days_only: bool = False):
+        """
+        :param catch_up: Plan every missing monthly reading since the last Tado reading in one go,
+            instead of only the next one
+        :param consumption_unit: The unit Octopus reports the consumption in, kwh is converted to m³ for the readings
+        :param calorific_value: The calorific value of the gas in MJ/m³, used to convert kWh
+        :param max_estimated_share: The largest share of a reading's consumption which may be estimated for gaps in
+            the Octopus data, readings above it are not submitted
+        :param completed_days_only: Work out today's reading from the consumption until midnight, so it only changes
+            when Octopus data for a completed day arrives, e.g. for the daemon syncing many times a day
+        """
+        if consumption_unit not in CONSUMPTION_UNITS:
+            raise ValueError(f"Unsupported consumption unit {consumption_unit}, expected one of "
+                             f"{', '.join(CONSUMPTION_UNITS)}")
+        self.consumption_source = consumption_source
+        self.tado_client = tado_client
+        self.logger_ = logger_
+        self.now = now
+        self.catch_up = catch_up
+        self.consumption_unit = consumption_unit
+        self.calorific_value = calorific_value
+        self.max_estimated_share = max_estimated_share
+        self.completed_days_only = completed_days_only
+
+    def current_time(self) -> datetime:
+        now = self.now or datetime.now()
+        if self.completed_days_only:
+            return now.replace(hour=0, minute=0, second=0, microsecond=0)
+        return now
+
+    def to_reading_units(self, consumption: float) -> float:
+        """
+        Converts consumption reported by Octopus to the unit of the meter readings
+        """
+        if self.consumption_unit == "kwh":
+            return kwh_to_cubic_metres(consumption, self.calorific_value)
+        return consumption
+
+    def baseline_window_start(self) -> datetime:
+        """
+        Returns the oldest date a Tado reading can have to be used as the baseline
+        """
+        return self.current_time() - BASELINE_WINDOW
+
+    def reading_dates(self, last_date: datetime) -> list[datetime]:
+        """
+        Returns the dates readings should be submitted for. Readings are a month apart on the day of the month of the
+        last reading, as long as that is more than 30 days ago, and the last one is for now.
+        Without catch up only the first of these dates is returned.
+        """
+        now = self.current_time()
+        dates = []
+        months = 1
+        to_date = last_date
+        while (now - to_date).days > 30:
+            # With add_months we make sure that we get exactly 1 month in advance of the previous reading,
+            # This also takes in account December to January rollover and months shorter than the day of the month
+            to_date = add_months(last_date, months)
+            dates.append(to_date)
+            if not self.catch_up:
+                return dates
+            months += 1
+        if not dates or dates[-1].date() < now.date():
+            # We just need to get the consumption from this date onwards
+            dates.append(now)
+        return dates
+
+    def plan(self, meter_readings: dict | None = None) -> SyncPlan:
+        """
+        Works out the readings to submit, without submitting anything.
+        :param meter_readings: The response of get_eiq_meter_readings, it is requested if not given
+        """
+        if meter_readings is None:
+            meter_readings = self.tado_client.get_eiq_meter_readings()
+        with RUN_METRICS.phase("reconciliation"):
+            return self._plan(meter_readings)
+
+    def _plan(self, meter_readings: dict) -> SyncPlan:
+        readings = ReadingIndex(meter_readings)
+        baseline = readings.first_on_or_after(self.baseline_window_start())
+        latest = readings.latest()
+        if baseline is None or latest is None:
+            self.logger_.error(f"There is no reading in Tado from the last 2 years to start from")
+            return SyncPlan(None, None, None, None, errors=["There is no reading in Tado from the last 2 years"])
+        first_date_reading_submitted_to_tado, first_reading_submitted_to_tado = baseline
+        last_date_reading_submitted_to_tado, last_reading_submitted_to_tado = latest
+
+        self.logger_.info(f"Reading submitted to tado on {first_date_reading_submitted_to_tado} was "
+                          f"{first_reading_submitted_to_tado} this was about 2 years ago")
+        self.logger_.info(f"Last reading submitted to tado on {last_date_reading_submitted_to_tado} was "
+                          f"{last_reading_submitted_to_tado}")
+        plan = SyncPlan(first_date_reading_submitted_to_tado, first_reading_submitted_to_tado,
+                        last_date_reading_submitted_to_tado, last_reading_submitted_to_tado)
+
+        to_dates = self.reading_dates(last_date_reading_submitted_to_tado)
+        self.logger_.debug(f"Getting consumption between {first_date_reading_submitted_to_tado} and {to_dates[-1]} "
+                           f"for {len(to_dates)} readings")
+        try:
+            consumptions = self.consumption_source.reconciled_consumption(first_date_reading_submitted_to_tado,
+                                                                          to_dates)
+        except InsufficientDataError as ex:
+            self.logger_.error(f"The missing Octopus data can't be estimated: {ex}")
+            plan.errors.append(str(ex))
+            return plan
+
+        previous_reading = last_reading_submitted_to_tado
+        for to_date, (measured, estimated) in zip(to_dates, consumptions):
+            consumption = self.to_reading_units(measured + estimated)
+            confidence = "measured"
+            if estimated > 0:
+                estimated_share = estimated / (measured + estimated)
+                confidence = "estimated" if estimated_share <= self.max_estimated_share else "low"
+                self.logger_.warning(f"Octopus is missing data until {to_date}, {estimated_share:.1%} of the "
+                                     f"consumption is estimated")
+            if confidence == "low":
+                self.logger_.error(f"Too much of the consumption until {to_date} is estimated to submit a reading")
+                plan.errors.append(f"{estimated_share:.1%} of the consumption for {to_date.strftime('%Y-%m-%d')} is "
+                                   f"estimated, more than the allowed {self.max_estimated_share:.1%}")
+                break
+            new_reading = int(first_reading_submitted_to_tado + consumption)
+            if new_reading < previous_reading:
+                self.logger_.warning(f"Something went wrong new reading {new_reading} is lower than the highest reading "
+                                     f"already submitted {previous_reading}")
+                self.logger_.error(f"The current reading can't be less than the previously added reading, "
+                                   f"please check the value or date and try again.")
+                self.logger_.error(f"Octopus has no data from bulb!!!")
+                plan.errors.append(f"New reading {new_reading} for {to_date.strftime('%Y-%m-%d')} is lower than the "
+                                   f"previous reading {previous_reading}")
+                break
+            previous_reading = new_reading
+            if readings.reading_on(to_date) == new_reading:
+                self.logger_.info(f"Tado already has the reading {new_reading} for {to_date.strftime('%Y-%m-%d')}")
+                continue
+            plan.readings.append(PlannedReading(to_date, new_reading, consumption, self.to_reading_units(estimated),
+                                                confidence))
+        return plan
+
+    def execute(self, plan: SyncPlan) -> list:
+        """
+        Submits the readings of the plan to Tado, in order.
+        :return: The responses of Tado
+        """
+        results = []
+        with RUN_METRICS.phase("submission"):
+            for planned in plan.readings:
+                self.logger_.info(f"Submitting new_date {planned.date} with new_reading {planned.reading}")
+                results.append(self.tado_client.set_eiq_meter_readings(reading=int(planned.reading),
+                                                                       date=planned.date.strftime('%Y-%m-%d')))
+                RUN_METRICS.increment("readings_submitted")
+        return results
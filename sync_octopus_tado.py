@@ -1,22 +1,62 @@
 import argparse
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from Octopus_Functions import get_consumption_between_dates
-from TADO_functions import tado_login
+from consumption_store import ConsumptionStore, DEFAULT_STORE_PATH
+from Octopus_Functions import DEFAULT_MAX_WORKERS, OctopusMeter
+from sync_engine import (BASELINE_WINDOW, CONSUMPTION_UNITS, DEFAULT_CALORIFIC_VALUE, DEFAULT_MAX_ESTIMATED_SHARE,
+                         SyncEngine)
+from TADO_functions import (DEFAULT_TOKEN_FILE_PATH, EIQ_METER_FUELS, TadoReadingCache, TadoHome,
+                            default_readings_cache_path, tado_login)
 from logging_functions import create_debug_info_console_logger
+from metrics_functions import RUN_METRICS
+from run_recording import record_run
 from datetime import date
 
 
-def parse_args():
+def parse_args(parser: argparse.ArgumentParser | None = None):
     """
     Parses command-line arguments for Tado and Octopus API credentials and meter details.
+    :param parser: A parser which already has the arguments of another entry point, e.g. the daemon
     """
-    parser = argparse.ArgumentParser(
-            description="Tado and Octopus API Interaction Script"
-        )
+    if parser is None:
+        parser = argparse.ArgumentParser(
+                description="Tado and Octopus API Interaction Script"
+            )
     try:
         # Tado API arguments
         parser.add_argument("--tado-email", required=True, help="Tado account email")
         parser.add_argument("--tado-password", required=True, help="Tado account password")
+        parser.add_argument(
+            "--tado-home-id",
+            type=int,
+            default=None,
+            help="Id of the Tado home the readings belong to (default the first home of the account)",
+        )
+        parser.add_argument(
+            "--tado-token-file",
+            default=DEFAULT_TOKEN_FILE_PATH,
+            help="File used to keep the Tado refresh token between runs",
+        )
+        parser.add_argument(
+            "--tado-readings-cache",
+            default=None,
+            help="File used to cache the Energy IQ meter readings already submitted to Tado "
+                 "(default tado_meter_readings_<email>[_<home id>].json, one per account and home)",
+        )
+        parser.add_argument(
+            "--tado-readings-max-age",
+            type=float,
+            default=24,
+            help="Hours after which the cached Tado meter readings are downloaded again",
+        )
+        parser.add_argument(
+            "--login-screenshot",
+            default=None,
+            help="Save a screenshot of the browser login page to this file (only used when the browser login is needed)",
+        )
 
         # Octopus API arguments
         parser.add_argument(
@@ -25,9 +65,81 @@ def parse_args():
             help="MPRN (Meter Point Reference Number) for the gas meter",
         )
         parser.add_argument(
-            "--gas-serial-number", required=True, help="Gas meter serial number"
+            "--gas-serial-number", "--serial-number", required=True, help="Gas meter serial number"
+        )
+        parser.add_argument(
+            "--fuel",
+            choices=list(EIQ_METER_FUELS),
+            default="gas",
+            help="Type of the Octopus meter. Tado Energy IQ only takes gas meter readings, so only gas is supported",
         )
         parser.add_argument("--octopus-api-key", required=True, help="Octopus API key")
+        parser.add_argument(
+            "--octopus-concurrency",
+            type=int,
+            default=DEFAULT_MAX_WORKERS,
+            help="Maximum number of Octopus requests fetched in parallel",
+        )
+
+        # Local storage arguments
+        parser.add_argument(
+            "--consumption-store",
+            default=DEFAULT_STORE_PATH,
+            help="SQLite file used to cache the Octopus consumption history between runs",
+        )
+
+        # Metrics arguments
+        parser.add_argument(
+            "--metrics-json",
+            default=None,
+            help="Write the timings and counters of the run to this JSON file",
+        )
+        parser.add_argument(
+            "--metrics-prom",
+            default=None,
+            help="Write the timings and counters of the run to this file in the Prometheus textfile format",
+        )
+
+        # Reconciliation arguments
+        parser.add_argument(
+            "--consumption-unit",
+            choices=list(CONSUMPTION_UNITS),
+            default="m3",
+            help="Unit Octopus reports the gas consumption in: m3 for SMETS2 meters, kwh for SMETS1 meters "
+                 "(converted to m³ with the calorific value)",
+        )
+        parser.add_argument(
+            "--calorific-value",
+            type=float,
+            default=DEFAULT_CALORIFIC_VALUE,
+            help=f"Calorific value of the gas in MJ/m³, as shown on the gas bill (default {DEFAULT_CALORIFIC_VALUE})",
+        )
+        parser.add_argument(
+            "--max-estimated-share",
+            type=float,
+            default=DEFAULT_MAX_ESTIMATED_SHARE,
+            help="Largest share of a reading which may be estimated for gaps in the Octopus data "
+                 f"(default {DEFAULT_MAX_ESTIMATED_SHARE})",
+        )
+
+        # Sync arguments
+        parser.add_argument(
+            "--catch-up",
+            action="store_true",
+            help="Submit every missing monthly reading since the last Tado reading, instead of only the next one",
+        )
+        parser.add_argument(
+            "--dry-run",
+            "--plan",
+            action="store_true",
+            help="Print the readings which would be submitted, without submitting them",
+        )
+        parser.add_argument(
+            "--record",
+            default=None,
+            help="Save the Tado readings, Octopus consumption and plan of the run to this file, "
+                 "to replay it offline with run_recording.py",
+        )
     except argparse.ArgumentError as e:
         print(f"Error parsing arguments: {e}")
         parser.print_help()
@@ -42,68 +154,107 @@ def parse_args():
         return parser.parse_args()
 
 
+@dataclass
+class SyncState:
+    """The consumption store, Octopus meter and Tado readings cache of a sync, which the daemon keeps between runs"""
+    store: ConsumptionStore
+    meter: OctopusMeter
+    tado_readings: TadoReadingCache
+
+
+def create_sync_state(args, logger_: logging.Logger, tado_factory=None) -> SyncState:
+    """
+    Opens the consumption store and readings cache for the arguments
+    :param tado_factory: Returns the logged in Tado object, by default tado_login with the arguments
+    """
+    if args.fuel not in EIQ_METER_FUELS:
+        raise ValueError(f"Tado Energy IQ only takes {', '.join(EIQ_METER_FUELS)} meter readings, not {args.fuel}")
+    if tado_factory is None:
+        # tado = Tado(args.tado_email, args.tado_password)
+        def tado_factory():
+            tado = tado_login(username=args.tado_email, password=args.tado_password, logger_=logger_,
+                              token_file_path=args.tado_token_file, screenshot_path=args.login_screenshot)
+            # Meters of the same account share the Tado object, which only one of them may use at a time
+            return TadoHome(tado, args.tado_home_id, logger_)
+    store = ConsumptionStore(args.consumption_store, logger_, read_only=args.dry_run)
+    meter = OctopusMeter(args.octopus_api_key, args.mprn, args.gas_serial_number, args.fuel, store, logger_,
+                         args.octopus_concurrency)
+    # Tado is only logged in to when the reading cache has to be refreshed or a reading is submitted
+    readings_cache_path = args.tado_readings_cache or default_readings_cache_path(args.tado_email, args.tado_home_id)
+    tado_readings = TadoReadingCache(readings_cache_path, tado_factory,
+                                     timedelta(hours=args.tado_readings_max_age), logger_)
+    return SyncState(store, meter, tado_readings)
+
+
+async def sync(args, logger_: logging.Logger, tado_factory=None, state: SyncState | None = None,
+               completed_days_only: bool = False) -> dict:
+    """
+    Syncs the Octopus consumption to Tado Energy IQ.
+    The Tado meter readings come from the local cache when it is fresh. Otherwise the Tado login and meter reading
+    download run at the same time as the Octopus consumption download, so the run takes as long as the slowest of the
+    two instead of their sum.
+    A dry run only plans from the local consumption store and readings cache: nothing is downloaded, logged in to,
+    submitted or written, apart from the recording if one is asked for.
+    :param tado_factory: Returns the logged in Tado object, by default tado_login with the arguments
+    :param state: The store, meter and readings cache of a previous run to reuse, see create_sync_state
+    :param completed_days_only: Plan today's reading from the consumption until midnight, see SyncEngine
+    :return: A summary of the run, with the status and the readings submitted (if any)
+    """
+    if state is None:
+        state = create_sync_state(args, logger_, tado_factory)
+    meter, tado_readings = state.meter, state.tado_readings
+    tado_readings.refreshed = False
+    now = datetime.now()
+    baseline_window_start = now - BASELINE_WINDOW
+
+    if args.dry_run:
+        if tado_readings.readings is None:
+            raise FileNotFoundError(f"A dry run needs the Tado readings cache {tado_readings.path}, "
+                                    f"run once without --dry-run to download it")
+        if tado_readings.is_stale():
+            logger_.warning(f"Planning with the Tado readings cached at {tado_readings.fetched_at}, "
+                            f"a dry run doesn't download them again")
+        meter_readings = {"readings": tado_readings.readings}
+    else:
+        meter_readings, _ = await asyncio.gather(
+            asyncio.to_thread(tado_readings.get_eiq_meter_readings),
+            asyncio.to_thread(meter.update, baseline_window_start),
+        )
+
+    # The store was brought up to date at the same time (unless this is a dry run), so the plan is worked out locally
+    engine = SyncEngine(meter, tado_readings, logger_, now=now, catch_up=args.catch_up,
+                        consumption_unit=args.consumption_unit, calorific_value=args.calorific_value,
+                        max_estimated_share=args.max_estimated_share, completed_days_only=completed_days_only)
+    plan = engine.plan(meter_readings)
+    if plan.errors and not tado_readings.refreshed and not args.dry_run:
+        logger_.warning(f"The plan based on the cached Tado readings failed, downloading them again")
+        meter_readings = await asyncio.to_thread(tado_readings.refresh)
+        plan = engine.plan(meter_readings)
+    if args.record:
+        recording = await asyncio.to_thread(record_run, meter, engine, meter_readings, plan,
+                                            plan.baseline_date or baseline_window_start)
+        recording.save(args.record)
+        logger_.info(f"Recorded the run to {args.record}")
+    if args.dry_run:
+        logger_.info(f"Dry run, {len(plan.readings)} readings are not submitted")
+        return {"mprn": args.mprn, "status": "rejected" if plan.errors else "planned", **plan.to_dict()}
+    await asyncio.to_thread(engine.execute, plan)
+
+    return {"mprn": args.mprn, "status": "rejected" if plan.errors else "submitted", **plan.to_dict()}
+
+
 if __name__ == "__main__":
     args = parse_args()
 
-    log_obj = create_debug_info_console_logger("sync_octopus_tado")
-
-    # tado = Tado(args.tado_email, args.tado_password)
-    tado = tado_login(username=args.tado_email, password=args.tado_password, logger_=log_obj)
-    result = tado.get_eiq_meter_readings()
-
-    first_date_reading_submitted_to_tado = datetime(year=9999, month=12, day=31)
-    first_reading_submitted_to_tado = 999999999
-
-    last_date_reading_submitted_to_tado = datetime(year=2000, month=1, day=1)
-    last_reading_submitted_to_tado = 0
-    for reading in result["readings"]:
-        this_date = datetime(year=int(reading["date"][:4]),
-                             month=int(reading["date"][5:7]),
-                             day=int(reading["date"][8:]))
-        if this_date > last_date_reading_submitted_to_tado:
-            last_date_reading_submitted_to_tado = this_date
-            last_reading_submitted_to_tado = reading["reading"]
-        # This date needs to be hardcoded for me, as this is the date I was moved from bulb to tado
-        # There is a meter reading submitted for this date in tado as well, so they can synchronise
-        # if datetime(year=2023, month=2, day=24) <= this_date < first_date_reading_submitted_to_tado:
-        # Get the date 2 years ago from today plus 30 days
-        two_years_ago = datetime.now() - timedelta(days=2*365 - 30)
-        if two_years_ago <= this_date < first_date_reading_submitted_to_tado:
-            first_date_reading_submitted_to_tado = this_date
-            first_reading_submitted_to_tado = reading["reading"]
-    log_obj.info(f"Reading submitted to tado on {first_date_reading_submitted_to_tado} was "
-                 f"{first_reading_submitted_to_tado} this was about 2 years ago")
-    log_obj.info(f"Last reading submitted to tado on {last_date_reading_submitted_to_tado} was "
-                 f"{last_reading_submitted_to_tado}")
-
-    if (datetime.now() - last_date_reading_submitted_to_tado).days > 30:
-        # We need to just get the consumption between 2 dates
-        to_date = last_date_reading_submitted_to_tado + timedelta(days=30)
-        # With the below we make sure that we get exactly 1 month in advance of the previous reading,
-        # This also takes in account December to January rollover,
-        # TODO Days over 28 are not supported because of February
-        to_date = datetime(year=to_date.year, month=to_date.month, day=last_date_reading_submitted_to_tado.day)
-    else:
-        # We just need to get the consumption from this date onwards
-        to_date = datetime.now()
-    log_obj.debug(f"Getting consumption between {first_date_reading_submitted_to_tado} and {to_date}")
-    # Get consumption from Octopus Energy API
-    consumption = get_consumption_between_dates(first_date_reading_submitted_to_tado, to_date,
-                                                args.octopus_api_key, args.mprn, args.gas_serial_number, log_obj)
-    # Get total consumption from Octopus Energy API
-    # consumption = get_meter_reading_total_consumption(args.octopus_api_key, args.mprn, args.gas_serial_number)
-
-    new_reading = int(first_reading_submitted_to_tado + consumption)
-    if new_reading < last_reading_submitted_to_tado:
-        log_obj.warning(f"Something went wrong new reading {new_reading} is lower than the highest reading already "
-                     f"submitted {last_reading_submitted_to_tado}")
-        log_obj.error(f"The current reading can't be less than the previously added reading, "
-                      f"please check the value or date and try again.")
-        log_obj.error(f"Octopus has no data from bulb!!!")
-    else:
-        log_obj.info(f"Submitting new_date {to_date} with new_reading {new_reading}")
-        # send_reading_to_tado_with_date(args.tado_email, args.tado_password, new_reading, to_date)
-        tado.set_eiq_meter_readings(reading=int(new_reading), date=to_date.strftime('%Y-%m-%d'))
+    log_obj = create_debug_info_console_logger("sync_octopus_tado", use_queue=True)
 
-    # Send the total consumption to Tado
-    # send_reading_to_tado(args.tado_email, args.tado_password, consumption)
+    try:
+        result = asyncio.run(sync(args, log_obj))
+        if args.dry_run:
+            print(json.dumps(result, indent=2))
+    finally:
+        if args.metrics_json:
+            RUN_METRICS.write_json(args.metrics_json)
+        if args.metrics_prom:
+            RUN_METRICS.write_prometheus(args.metrics_prom)
+        log_obj.info(f"Run metrics: {RUN_METRICS.to_dict()}")
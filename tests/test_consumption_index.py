@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from consumption_index import ConsumptionIndex, InsufficientDataError, MIN_EXTRAPOLATION_SECONDS
+from consumption_store import to_epoch
+
+HALF_HOUR = 30 * 60
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def half_hours(period_from: datetime, period_to: datetime, consumption: float = 0.5) -> list[tuple[int, int, float]]:
+    return [(start, start + HALF_HOUR, consumption) for start in range(to_epoch(period_from), to_epoch(period_to),
+                                                                         HALF_HOUR)]
+
+
+def test_reconcile_without_gaps_only_measures():
+    index = ConsumptionIndex(half_hours(START, START + timedelta(days=10)), START, START + timedelta(days=10))
+
+    assert index.reconcile(START, [START + timedelta(days=1), START + timedelta(days=10)]) == [(24.0, 0.0),
+                                                                                                (240.0, 0.0)]
+
+
+def test_a_gap_is_estimated_from_the_data_around_it():
+    rows = (half_hours(START, START + timedelta(days=3))
+            + half_hours(START + timedelta(days=3, hours=6), START + timedelta(days=6)))
+    index = ConsumptionIndex(rows, START, START + timedelta(days=6))
+
+    [(measured, estimated)] = index.reconcile(START, [START + timedelta(days=6)])
+
+    assert measured == pytest.approx(144 - 6)
+    assert estimated == pytest.approx(6)
+    assert index.gap_seconds() == 6 * 60 * 60
+
+
+def test_part_of_a_gap_is_estimated_up_to_the_date():
+    rows = (half_hours(START, START + timedelta(days=3))
+            + half_hours(START + timedelta(days=3, hours=6), START + timedelta(days=6)))
+    index = ConsumptionIndex(rows, START, START + timedelta(days=6))
+
+    [(_, estimated)] = index.reconcile(START, [START + timedelta(days=3, hours=2)])
+
+    assert estimated == pytest.approx(2)
+
+
+def test_a_gap_after_the_last_interval_is_not_estimated():
+    index = ConsumptionIndex(half_hours(START, START + timedelta(days=3)), START, START + timedelta(days=5))
+
+    assert index.reconcile(START, [START + timedelta(days=5)]) == [(72.0, 0.0)]
+
+
+def test_a_leading_gap_is_extrapolated_from_the_first_week():
+    data_from = START + timedelta(days=2)
+    rows = (half_hours(data_from, data_from + timedelta(days=7), 0.5)
+            + half_hours(data_from + timedelta(days=7), data_from + timedelta(days=14), 2.0))
+    index = ConsumptionIndex(rows, START, data_from + timedelta(days=14))
+
+    [(measured, estimated)] = index.reconcile(START, [data_from + timedelta(days=14)])
+
+    assert measured == pytest.approx(7 * 24 + 7 * 96)
+    # At the rate of the first week only, 1 per hour
+    assert estimated == pytest.approx(48)
+
+
+def test_a_leading_gap_is_not_extrapolated_from_less_than_a_week():
+    data_from = START + timedelta(days=2)
+    days_of_data = MIN_EXTRAPOLATION_SECONDS // (24 * 60 * 60) - 1
+    index = ConsumptionIndex(half_hours(data_from, data_from + timedelta(days=days_of_data)), START,
+                             data_from + timedelta(days=days_of_data))
+
+    with pytest.raises(InsufficientDataError):
+        index.reconcile(START, [data_from + timedelta(days=days_of_data)])
+    # The gap doesn't matter for a window after it
+    assert index.reconcile(data_from, [data_from + timedelta(days=1)]) == [(24.0, 0.0)]
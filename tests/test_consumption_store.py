@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import Octopus_Functions
+from consumption_index import IntervalBuffer
+from consumption_store import ConsumptionStore, to_epoch
+from Octopus_Functions import update_consumption_store
+
+HALF_HOUR = 30 * 60
+MPRN = "1234567890"
+SERIAL_NUMBER = "G4A00000000000"
+
+
+class OctopusStandIn:
+    """Serves half-hourly consumption of 0.5 between first and last, and records the windows asked for"""
+    def __init__(self, first: datetime, last: datetime):
+        self.first = first
+        self.last = last
+        self.requests = []
+
+    def get_consumption_intervals_concurrently(self, period_from: datetime, period_to: datetime, *args,
+                                               **kwargs) -> IntervalBuffer:
+        self.requests.append((period_from, period_to))
+        buffer = IntervalBuffer()
+        for start in range(max(to_epoch(period_from), to_epoch(self.first)),
+                           min(to_epoch(period_to), to_epoch(self.last)), HALF_HOUR):
+            buffer.append(start, start + HALF_HOUR, 0.5)
+        return buffer
+
+
+@pytest.fixture
+def octopus(monkeypatch) -> OctopusStandIn:
+    stand_in = OctopusStandIn(datetime(2024, 3, 1, tzinfo=timezone.utc), datetime(2024, 4, 1, tzinfo=timezone.utc))
+    monkeypatch.setattr(Octopus_Functions, "get_consumption_intervals_concurrently",
+                        stand_in.get_consumption_intervals_concurrently)
+    return stand_in
+
+
+@pytest.fixture
+def store(tmp_path) -> ConsumptionStore:
+    return ConsumptionStore(str(tmp_path / "consumption.sqlite"))
+
+
+def update(store: ConsumptionStore, period_from: datetime) -> int:
+    return update_consumption_store(store, period_from, "api-key", MPRN, SERIAL_NUMBER)
+
+
+def test_an_empty_store_is_filled_from_period_from(octopus, store):
+    period_from = datetime(2024, 3, 10, tzinfo=timezone.utc)
+
+    assert update(store, period_from) == 22 * 48
+
+    assert [window_from for window_from, _ in octopus.requests] == [period_from]
+    assert store.checked_from(MPRN, SERIAL_NUMBER) == period_from
+    assert store.earliest_interval_start(MPRN, SERIAL_NUMBER) == period_from
+    assert store.latest_interval_end(MPRN, SERIAL_NUMBER) == octopus.last
+    assert store.consumption_between(MPRN, SERIAL_NUMBER, period_from) == 22 * 48 * 0.5
+
+
+def test_only_intervals_after_the_latest_one_are_downloaded_again(octopus, store):
+    period_from = datetime(2024, 3, 10, tzinfo=timezone.utc)
+    update(store, period_from)
+    octopus.requests.clear()
+    octopus.last += timedelta(days=1)
+
+    assert update(store, period_from) == 48
+
+    assert [window_from for window_from, _ in octopus.requests] == [octopus.last - timedelta(days=1)]
+    assert store.latest_interval_end(MPRN, SERIAL_NUMBER) == octopus.last
+
+
+def test_moving_period_from_back_backfills_the_older_history(octopus, store):
+    update(store, datetime(2024, 3, 10, tzinfo=timezone.utc))
+    octopus.requests.clear()
+
+    assert update(store, datetime(2024, 3, 5, tzinfo=timezone.utc)) == 5 * 48
+
+    assert octopus.requests[0] == (datetime(2024, 3, 5, tzinfo=timezone.utc),
+                                   datetime(2024, 3, 10, tzinfo=timezone.utc))
+    assert [window_from for window_from, _ in octopus.requests[1:]] == [octopus.last]
+    assert store.checked_from(MPRN, SERIAL_NUMBER) == datetime(2024, 3, 5, tzinfo=timezone.utc)
+    assert store.earliest_interval_start(MPRN, SERIAL_NUMBER) == datetime(2024, 3, 5, tzinfo=timezone.utc)
+
+
+def test_history_octopus_doesnt_have_is_not_asked_for_again(octopus, store):
+    period_from = datetime(2024, 2, 1, tzinfo=timezone.utc)
+    update(store, period_from)
+    octopus.requests.clear()
+
+    assert update(store, period_from) == 0
+
+    assert store.checked_from(MPRN, SERIAL_NUMBER) == period_from
+    assert store.earliest_interval_start(MPRN, SERIAL_NUMBER) == octopus.first
+    assert [window_from for window_from, _ in octopus.requests] == [octopus.last]
+
+
+def test_intervals_between_reads_the_window_in_order(store):
+    start = to_epoch(datetime(2024, 3, 1, tzinfo=timezone.utc))
+    store.add_rows(MPRN, SERIAL_NUMBER, [(start + HALF_HOUR, start + 2 * HALF_HOUR, 0.25),
+                                         (start, start + HALF_HOUR, 0.5)])
+    store.add_rows(MPRN, SERIAL_NUMBER, [(start, start + HALF_HOUR, 0.75)])
+    store.add_rows("another meter", SERIAL_NUMBER, [(start, start + HALF_HOUR, 9.0)])
+
+    assert store.intervals_between(MPRN, SERIAL_NUMBER, datetime(2024, 3, 1, tzinfo=timezone.utc),
+                                   datetime(2024, 3, 2, tzinfo=timezone.utc)) == [
+        (start, start + HALF_HOUR, 0.75), (start + HALF_HOUR, start + 2 * HALF_HOUR, 0.25)]
+    assert store.consumption_between(MPRN, SERIAL_NUMBER, datetime(2024, 3, 1, tzinfo=timezone.utc)) == 1.0
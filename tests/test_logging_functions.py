@@ -0,0 +1,29 @@
+import threading
+
+import logging_functions
+from logging_functions import create_debug_info_console_logger, stop_queue_listener
+
+
+def test_setting_up_the_queue_logger_again_reuses_its_listener(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    logger_ = create_debug_info_console_logger("first", use_queue=True)
+    try:
+        threads = threading.active_count()
+        handlers = list(logger_.handlers)
+
+        assert create_debug_info_console_logger("first", use_queue=True) is logger_
+        assert logger_.handlers == handlers
+        assert threading.active_count() == threads
+        assert len(logging_functions._queue_listeners) == 1
+
+        # Other settings replace the handlers and the listener instead of adding to them
+        create_debug_info_console_logger("second", use_queue=True)
+        assert len(logger_.handlers) == 1
+        assert len(logging_functions._queue_listeners) == 1
+        assert threading.active_count() == threads
+    finally:
+        stop_queue_listener(logger_)
+        for handler in list(logger_.handlers):
+            logger_.removeHandler(handler)
+            handler.close()
+        logging_functions._logger_settings.clear()
@@ -0,0 +1,37 @@
+import asyncio
+
+from metrics_functions import RunMetrics
+
+
+def test_meters_keep_their_own_labels_and_add_up_to_the_run():
+    metrics = RunMetrics()
+
+    async def sync_meter(name: str, login_path: str):
+        with metrics.meter(name):
+            await asyncio.to_thread(metrics.set_label, "tado_login_path", login_path)
+            await asyncio.to_thread(metrics.increment, "readings_submitted")
+
+    async def sync_batch():
+        await asyncio.gather(sync_meter("Home", "token"), sync_meter("Flat", "browser"))
+
+    asyncio.run(sync_batch())
+    summary = metrics.to_dict()
+
+    assert summary["counters"] == {"readings_submitted": 2}
+    assert summary["labels"] == {}
+    assert summary["meters"]["Home"]["labels"] == {"tado_login_path": "token"}
+    assert summary["meters"]["Flat"]["labels"] == {"tado_login_path": "browser"}
+    assert summary["meters"]["Flat"]["counters"] == {"readings_submitted": 1}
+
+
+def test_prometheus_labels_every_meter():
+    metrics = RunMetrics()
+    metrics.increment("readings_submitted")
+    with metrics.meter('Mum "n" Dad'):
+        metrics.increment("readings_submitted")
+
+    lines = metrics.to_prometheus().splitlines()
+
+    assert lines.count("# TYPE octopus_tado_sync_readings_submitted gauge") == 1
+    assert "octopus_tado_sync_readings_submitted 2" in lines
+    assert 'octopus_tado_sync_readings_submitted{meter="Mum \\"n\\" Dad"} 1' in lines
@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from consumption_index import IntervalBuffer
+from Octopus_Functions import (_ceil_to_boundary, _floor_to_boundary, parse_consumption_stream, plan_aggregated_windows,
+                               split_into_shards)
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("value, group_by, floor, ceil", [
+    # Greenwich Mean Time, the buckets start at midnight UTC
+    (utc(2024, 1, 15, 12), "day", utc(2024, 1, 15), utc(2024, 1, 16)),
+    (utc(2024, 2, 15, 12), "month", utc(2024, 2, 1), utc(2024, 3, 1)),
+    # British Summer Time, the buckets start at 23:00 UTC the day before
+    (utc(2024, 7, 15, 12), "day", utc(2024, 7, 14, 23), utc(2024, 7, 15, 23)),
+    (utc(2024, 7, 15, 12), "month", utc(2024, 6, 30, 23), utc(2024, 7, 31, 23)),
+    (utc(2024, 7, 15, 12), "quarter", utc(2024, 6, 30, 23), utc(2024, 9, 30, 23)),
+    # 23:30 UTC on 30 June is already 1 July in London
+    (utc(2024, 6, 30, 23, 30), "day", utc(2024, 6, 30, 23), utc(2024, 7, 1, 23)),
+    (utc(2024, 6, 30, 23, 30), "hour", utc(2024, 6, 30, 23), utc(2024, 7, 1, 0)),
+])
+def test_boundaries_follow_europe_london(value, group_by, floor, ceil):
+    assert _floor_to_boundary(value, group_by) == floor
+    assert _ceil_to_boundary(value, group_by) == ceil
+
+
+def test_days_are_23_and_25_hours_long_when_the_clocks_change():
+    # The clocks go forward on 31 March 2024 and back on 27 October 2024
+    spring, autumn = utc(2024, 3, 31, 12), utc(2024, 10, 27, 12)
+    assert _ceil_to_boundary(spring, "day") - _floor_to_boundary(spring, "day") == timedelta(hours=23)
+    assert _ceil_to_boundary(autumn, "day") - _floor_to_boundary(autumn, "day") == timedelta(hours=25)
+
+
+def test_boundary_of_a_boundary_is_itself():
+    assert _ceil_to_boundary(utc(2024, 6, 30, 23), "quarter") == utc(2024, 6, 30, 23)
+    assert _floor_to_boundary(utc(2024, 6, 30, 23), "quarter") == utc(2024, 6, 30, 23)
+
+
+def test_aggregated_windows_across_bst_are_contiguous_and_aligned():
+    period_from, period_to = utc(2024, 3, 20, 10), utc(2024, 11, 3, 5)
+    windows = plan_aggregated_windows(period_from, period_to)
+
+    assert windows[0][0] == period_from
+    assert windows[-1][1] == period_to
+    assert all(previous[1] == current[0] for previous, current in zip(windows, windows[1:]))
+    for window_from, window_to, group_by in windows:
+        if group_by is not None:
+            assert _floor_to_boundary(window_from, group_by) == window_from
+            assert _floor_to_boundary(window_to, group_by) == window_to
+    assert (utc(2024, 3, 31, 23), utc(2024, 9, 30, 23), "quarter") in windows
+
+
+def test_month_shards_follow_europe_london():
+    assert split_into_shards(utc(2024, 3, 20), utc(2024, 5, 2)) == [
+        (utc(2024, 3, 20), utc(2024, 3, 31, 23)),
+        (utc(2024, 3, 31, 23), utc(2024, 4, 30, 23)),
+        (utc(2024, 4, 30, 23), utc(2024, 5, 2)),
+    ]
+
+
+PAGE = (b'{"count": 3, "next": "https://api.octopus.energy/v1/gas-meter-points/1/meters/2/consumption/?page=2", '
+        b'"previous": null, "results": [\n'
+        b'{"consumption": 0.123, "interval_start": "2024-07-01T00:00:00+01:00",\n'
+        b' "interval_end": "2024-07-01T00:30:00+01:00"},\n'
+        b'{"consumption": 1.5e-2, "interval_start": "2024-07-01T00:30:00+01:00",\n'
+        b' "interval_end": "2024-07-01T01:00:00+01:00"},\n'
+        b'{"consumption": 0, "interval_start": "2024-07-01T01:00:00+01:00",\n'
+        b' "interval_end": "2024-07-01T01:30:00+01:00"}]}')
+EXPECTED_ROWS = [(1719788400, 1719790200, 0.123), (1719790200, 1719792000, 0.015), (1719792000, 1719793800, 0.0)]
+NEXT_URL = "https://api.octopus.energy/v1/gas-meter-points/1/meters/2/consumption/?page=2"
+
+
+def parse(chunks) -> tuple[list, str | None]:
+    buffer = IntervalBuffer()
+    next_url = parse_consumption_stream(chunks, buffer)
+    return list(buffer.rows()), next_url
+
+
+def test_parse_consumption_stream_in_one_chunk():
+    assert parse([PAGE]) == (EXPECTED_ROWS, NEXT_URL)
+
+
+# The byte by byte test below covers every split point, these are the interesting ones
+@pytest.mark.parametrize("split", [
+    1,  # after the opening brace
+    PAGE.index(b'"next"') + 3,  # inside a key
+    PAGE.index(b"?page=2"),  # inside the next URL
+    PAGE.index(b"[") + 1,  # at the start of the results
+    PAGE.index(b"0.123") + 3,  # inside a number
+    PAGE.index(b"e-2") + 1,  # inside an exponent
+    PAGE.index(b"T00:30:00"),  # inside a date
+    PAGE.index(b"},\n") + 1,  # between two results
+    len(PAGE) - 1,  # before the closing brace
+])
+def test_parse_consumption_stream_split(split):
+    assert parse([PAGE[:split], PAGE[split:]]) == (EXPECTED_ROWS, NEXT_URL)
+
+
+def test_parse_consumption_stream_byte_by_byte():
+    assert parse([PAGE[position:position + 1] for position in range(len(PAGE))]) == (EXPECTED_ROWS, NEXT_URL)
+
+
+def test_parse_consumption_stream_with_the_next_url_after_the_results():
+    page = b'{"results": [], "count": 0, "next": null, "previous": null}'
+    assert parse([page[:5], page[5:20], page[20:]]) == ([], None)
+    page = b'{"results": [{"consumption": 1.0, "interval_start": "2024-01-01T00:00:00Z", ' \
+           b'"interval_end": "2024-01-01T00:30:00Z"}], "next": "https://example.com/?page=2"}'
+    assert parse([page[:60], page[60:]]) == ([(1704067200, 1704069000, 1.0)], "https://example.com/?page=2")
+
+
+def test_parse_consumption_stream_with_empty_chunks():
+    assert parse([b"", PAGE[:100], b"", PAGE[100:], b""]) == (EXPECTED_ROWS, NEXT_URL)
@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from consumption_index import InsufficientDataError
+from sync_engine import DEFAULT_CALORIFIC_VALUE, SyncEngine, add_months, kwh_to_cubic_metres
+
+
+class HourlyConsumption:
+    """Consumes 0.1 per hour, without any gaps"""
+    def reconciled_consumption(self, period_from: datetime, dates: list[datetime]) -> list[tuple[float, float]]:
+        return [((date - period_from).total_seconds() / 3600 * 0.1, 0.0) for date in dates]
+
+
+class SubmittedReadings:
+    def __init__(self):
+        self.submitted = []
+
+    def set_eiq_meter_readings(self, date: str, reading: int) -> dict:
+        self.submitted.append((date, reading))
+        return {}
+
+
+def meter_readings(*readings: tuple[str, int]) -> dict:
+    return {"readings": [{"date": date, "reading": reading} for date, reading in readings]}
+
+
+def test_completed_days_only_plans_today_from_midnight():
+    engine = SyncEngine(HourlyConsumption(), SubmittedReadings(), now=datetime(2024, 5, 20, 15, 30),
+                        completed_days_only=True)
+
+    plan = engine.plan(meter_readings(("2024-05-10", 1000)))
+
+    assert [(reading.date, reading.reading) for reading in plan.readings] == [(datetime(2024, 5, 20), 1024)]
+
+
+def test_a_reading_tado_already_has_is_not_submitted_again():
+    tado = SubmittedReadings()
+    engine = SyncEngine(HourlyConsumption(), tado, now=datetime(2024, 5, 20, 15, 30), completed_days_only=True)
+
+    plan = engine.plan(meter_readings(("2024-05-10", 1000), ("2024-05-20", 1024)))
+    engine.execute(plan)
+
+    assert plan.readings == []
+    assert tado.submitted == []
+
+
+class MissingStart:
+    def reconciled_consumption(self, period_from: datetime, dates: list[datetime]) -> list[tuple[float, float]]:
+        raise InsufficientDataError("There are only 2.0 days of Octopus data")
+
+
+def test_kwh_to_cubic_metres():
+    # 1 m³ of gas at 39.5 MJ/m³ holds 39.5 * 1.02264 / 3.6 kWh
+    assert kwh_to_cubic_metres(39.5 * 1.02264 / 3.6) == pytest.approx(1.0)
+    assert kwh_to_cubic_metres(11.22) == pytest.approx(11.22 * 3.6 / (DEFAULT_CALORIFIC_VALUE * 1.02264))
+    assert kwh_to_cubic_metres(100, calorific_value=40.0) < kwh_to_cubic_metres(100, calorific_value=38.0)
+
+
+def test_kwh_consumption_is_submitted_in_cubic_metres():
+    engine = SyncEngine(HourlyConsumption(), SubmittedReadings(), now=datetime(2024, 5, 20), consumption_unit="kwh")
+
+    plan = engine.plan(meter_readings(("2024-05-10", 1000)))
+
+    kwh = timedelta(days=10).total_seconds() / 3600 * 0.1
+    assert plan.readings[0].reading == int(1000 + kwh_to_cubic_metres(kwh))
+
+
+def test_consumption_which_cant_be_estimated_rejects_the_plan():
+    engine = SyncEngine(MissingStart(), SubmittedReadings(), now=datetime(2024, 5, 20))
+
+    plan = engine.plan(meter_readings(("2024-05-10", 1000)))
+
+    assert plan.readings == []
+    assert plan.errors == ["There are only 2.0 days of Octopus data"]
+
+
+@pytest.mark.parametrize("value, months, day, expected", [
+    (datetime(2024, 1, 31), 1, None, datetime(2024, 2, 29)),
+    (datetime(2023, 1, 31), 1, None, datetime(2023, 2, 28)),
+    (datetime(2024, 3, 31), 1, None, datetime(2024, 4, 30)),
+    (datetime(2024, 2, 29), 1, 31, datetime(2024, 3, 31)),
+    (datetime(2023, 12, 15, 8), 1, None, datetime(2024, 1, 15, 8)),
+    (datetime(2024, 1, 15), -1, None, datetime(2023, 12, 15)),
+    (datetime(2023, 11, 30), 3, None, datetime(2024, 2, 29)),
+])
+def test_add_months(value, months, day, expected):
+    assert add_months(value, months, day) == expected
+
+
+def test_catch_up_plans_every_month_on_the_day_of_the_last_reading_and_now():
+    now = datetime(2024, 5, 20, 12)
+    engine = SyncEngine(HourlyConsumption(), SubmittedReadings(), now=now, catch_up=True)
+
+    assert engine.reading_dates(datetime(2024, 1, 31)) == [
+        datetime(2024, 2, 29), datetime(2024, 3, 31), datetime(2024, 4, 30), now]
+
+
+def test_without_catch_up_only_the_next_month_is_planned():
+    engine = SyncEngine(HourlyConsumption(), SubmittedReadings(), now=datetime(2024, 5, 20, 12))
+
+    assert engine.reading_dates(datetime(2024, 1, 31)) == [datetime(2024, 2, 29)]
+
+
+def test_a_reading_from_the_last_30_days_is_followed_by_now():
+    now = datetime(2024, 5, 20, 12)
+    engine = SyncEngine(HourlyConsumption(), SubmittedReadings(), now=now, catch_up=True)
+
+    assert engine.reading_dates(datetime(2024, 5, 10)) == [now]
+
+
+def test_now_is_not_added_when_the_monthly_reading_is_due_today():
+    engine = SyncEngine(HourlyConsumption(), SubmittedReadings(), now=datetime(2024, 1, 1, 10), catch_up=True)
+
+    assert engine.reading_dates(datetime(2023, 12, 1)) == [datetime(2024, 1, 1)]
@@ -0,0 +1,68 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import requests
+
+from rate_limiter import RATE_LIMITER
+from TADO_functions import TadoHome, TadoLoginManager
+
+RESPONSES = {
+    "/oauth2/token": {"access_token": "access", "expires_in": 600, "refresh_token": "rotated"},
+    "/api/v2/me": {"homes": [{"id": 1}]},
+    "/api/v2/homes/1/": {"generation": "PRE_LINE_X"},
+    "/api/homes/1/meterReadings": {"readings": []},
+}
+
+
+def fake_send(adapter, request, **kwargs):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = request.url
+    response.request = request
+    response.headers["Content-Type"] = "application/json"
+    response._content = json.dumps(RESPONSES[requests.utils.urlparse(request.url).path]).encode()
+    return response
+
+
+def test_requests_of_a_logged_in_tado_object_go_through_the_rate_limiter(tmp_path, monkeypatch):
+    token_file = tmp_path / "tado_refresh_token"
+    token_file.write_text(json.dumps({"refresh_token": "stored"}))
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", fake_send)
+    paced = []
+    monkeypatch.setattr(RATE_LIMITER, "acquire", lambda url: paced.append(url) or 0.0)
+
+    manager = TadoLoginManager(str(token_file))
+    tado = manager.finish_login(manager.start_login())
+    # PyTado replaces its session with a new one whenever it refreshes the token
+    tado._http._refresh_at = datetime.now(timezone.utc) - timedelta(minutes=1)
+    tado.get_eiq_meter_readings()
+
+    assert manager.is_logged_in()
+    assert [requests.utils.urlparse(url).path for url in paced] == [
+        "/oauth2/token", "/api/v2/me", "/api/v2/homes/1/", "/oauth2/token", "/api/homes/1/meterReadings"]
+
+
+class HomeRecordingTado:
+    """Stands in for a logged in Tado object, answering with the home PyTado would send the request to"""
+    def __init__(self, first_home_id: int):
+        self._http = SimpleNamespace(_id=first_home_id)
+
+    def get_eiq_meter_readings(self) -> dict:
+        home_id = self._http._id
+        time.sleep(0.001)
+        return {"home_id": home_id, "sent_to": self._http._id}
+
+
+def test_homes_of_one_account_read_their_own_readings():
+    tado = HomeRecordingTado(1)
+    homes = [TadoHome(tado), TadoHome(tado, 2)] * 20
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda home: home.get_eiq_meter_readings(), homes))
+
+    assert homes[0].home_id == 1
+    assert results == [{"home_id": home.home_id, "sent_to": home.home_id} for home in homes]
+    assert tado._http._id == 1